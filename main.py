@@ -7,36 +7,95 @@ import sys # 确保导入sys模块
 import json # 用于读写cookies
 import time # 用于等待登录
 import random # 用于生成随机字符串
+import math # 用于由评论总数推算页数
+import functools # 用于缓存文本预处理结果
+import hashlib # 用于生成API响应磁盘缓存的文件名
 import string # 用于生成随机字符串
+import multiprocessing # 用于并行计算情感得分
+import threading # 用于在后台线程中预先加载 jieba 词典
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor # 用于并行渲染词云图; 后台绘制饼图
+import pickle # 用于缓存训练好的情感模型
 from collections import Counter
+from itertools import compress, chain, islice # 按布尔掩码筛选文本; 展平各条文本的分词结果; 截取情感得分缓存
+import numpy as np # 情感得分的向量化分桶 (随 pandas 一同安装)
 import pandas as pd # 用于读取CSV文件和输出Excel, 确保已安装: pip install pandas openpyxl
 
-# Selenium 相关导入
-from selenium import webdriver
-from selenium.webdriver.edge.service import Service as EdgeService
-from selenium.webdriver.edge.options import Options as EdgeOptions
-from selenium.common.exceptions import TimeoutException, WebDriverException
+import httpx # 用于扫码登录请求B站通行证接口 (bilibili-api-python 的依赖)
+# Selenium 仅在 LOGIN_METHOD = "selenium" 或扫码登录失败时才导入，见 get_bilibili_credential_via_selenium
 
 # 其他分析库
-import jieba # 确保已安装: pip install jieba
-import matplotlib.pyplot as plt # 确保已安装: pip install matplotlib
-from matplotlib.font_manager import FontProperties # 用于设置中文字体
+try:
+    import jieba_fast as jieba # jieba 的C扩展实现, 接口一致且分词更快: pip install jieba_fast
+except ImportError:
+    import jieba # 确保已安装: pip install jieba
+# matplotlib 导入较慢 (确保已安装: pip install matplotlib)，只在首次绘制饼图或按字体名查找字体时才导入，见 get_matplotlib
 # 核心的 bilibili_api 导入
-from bilibili_api import Credential, Danmaku, comment # 从顶层导入其他组件
+from bilibili_api import Credential, Danmaku, comment, aid2bvid # 从顶层导入其他组件
 from bilibili_api.video import Video # 尝试从 bilibili_api.video 子模块导入 Video 类
 from bilibili_api.comment import CommentResourceType # 尝试从 bilibili_api.comment 子模块导入 CommentResourceType
+from bilibili_api.exceptions import ResponseCodeException, NetworkException # API返回错误码 / HTTP状态码异常，用于判断是否值得重试
 
-from wordcloud import WordCloud # 确保已安装: pip install wordcloud
-from snownlp import SnowNLP # 确保已安装: pip install snownlp
+# wordcloud (确保已安装: pip install wordcloud) 只在渲染词云图时导入，见 render_wordcloud
+from PIL import Image, ImageDraw, ImageFont # 词云图标题绘制 (Pillow 随 wordcloud 一同安装)
+from snownlp import sentiment as snownlp_sentiment # 确保已安装: pip install snownlp (导入时即加载情感模型)
 
 # Fuzzy matching library (optional)
+# rapidfuzz: C++实现, 可用 process.cdist 一次算出全部 关键词×片段 的相似度矩阵
+try:
+    from rapidfuzz import fuzz, process as rapidfuzz_process
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+    print("警告: `rapidfuzz` 库未找到。将无法使用模糊匹配功能进行节目名称筛选。")
+    print("      若需此功能, 请安装: pip install rapidfuzz")
+
+# qrcode (optional, 扫码登录时在终端中显示二维码; 未安装时打印二维码链接)
+try:
+    import qrcode
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+
+# orjson (optional, 更快的JSON解析; 未安装时使用标准库 json)
 try:
-    from thefuzz import fuzz
-    THEFUZZ_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    THEFUZZ_AVAILABLE = False
-    print("警告: `thefuzz` 库未找到。将无法使用模糊匹配功能进行节目名称筛选。")
-    print("      若需此功能, 请安装: pip install thefuzz python-Levenshtein")
+    ORJSON_AVAILABLE = False
+
+def json_loads(data):
+    """解析UTF-8编码的JSON字节串，优先使用 orjson (直接解析字节，无需先解码为 str)。"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+def json_dumps(obj):
+    """将对象序列化为带缩进的UTF-8 JSON字节串，优先使用 orjson。"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8') # 与 orjson 的 OPT_INDENT_2 输出一致
+
+# pyahocorasick (optional, 评论分类关键词的单趟多模式匹配; 未安装时按类别使用编译后的正则)
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# xlsxwriter (optional, 以 constant_memory 模式逐行流式写出情感高频词Excel; 未安装时经 pandas 使用 openpyxl)
+try:
+    import xlsxwriter
+    XLSXWRITER_AVAILABLE = True
+except ImportError:
+    XLSXWRITER_AVAILABLE = False
+
+# scikit-learn (optional, 仅当 SENTIMENT_BACKEND = "sklearn" 时使用)
+try:
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
 
 
 # --- 配置区域 ---
@@ -45,10 +104,50 @@ DANMAKU_TXT_FILE = os.path.join(OUTPUT_DIR, "danmaku_combined.txt") # 所有片
 OVERALL_WORDCLOUD_IMAGE_FILE = os.path.join(OUTPUT_DIR, "wordcloud_overall_from_txt.png") # 基于TXT的总词云图
 SEGMENTED_FREQUENCY_REPORT_CSV = os.path.join(OUTPUT_DIR, "segmented_danmaku_frequency_report.csv") # 分段词频报告
 OVERALL_SENTIMENT_PIE_CHART_FILE = os.path.join(OUTPUT_DIR, "comment_sentiment_pie_overall.png") # 总体评论情感饼图
+CACHE_DIR = os.path.join(OUTPUT_DIR, ".cache") # 模型等中间结果的缓存目录
 
 # --- 新增配置 (常规情感分析) ---
 SENTIMENT_WORDS_EXCEL_FILE = os.path.join(OUTPUT_DIR, "sentiment_specific_word_frequencies.xlsx") # 情感高频词输出文件
 TOP_N_SENTIMENT_WORDS = 30 # 每个情感类别提取的最高频词数量 (用于Excel输出)
+SENTIMENT_WORDS_EXCEL_COLUMNS = ('Type', 'Scope', 'Sentiment', 'Word', 'Frequency') # 情感高频词Excel的列 (各行按此顺序存为元组)
+SENTIMENT_WORKERS = os.cpu_count() or 1 # 情感打分使用的进程数 (设为1则不启用多进程)
+SENTIMENT_PARALLEL_MIN_TEXTS = 2000 # 待打分文本数达到该值才启用多进程 (进程启动有固定开销)
+SENTIMENT_POOL_CHUNKSIZE = 256 # 每次分发给子进程的文本数量
+JIEBA_PARALLEL_WORKERS = os.cpu_count() or 1 # jieba 并行分词的进程数 (仅POSIX系统支持, 设为1则不启用)
+JIEBA_PARALLEL_MIN_TEXTS = 5000 # 单批待分词文本数(去重后)达到该值才启用并行分词
+WORDCLOUD_WORKERS = os.cpu_count() or 1 # 并行渲染片段词云图的进程数 (设为1则逐个渲染)
+JIEBA_POOL_CHUNKSIZE = 256 # 不支持 jieba 并行模式时，改用进程池分词，每次分发给子进程的文本数量
+# 分词器: "jieba" (默认, 安装了 jieba_fast 时自动使用其C扩展) 或 "lac" (百度LAC, 整批分词, 需 pip install lac)
+SEGMENTER = "jieba"
+PREPROCESS_CACHE_SIZE = 100_000 # 分词结果的缓存条数上限 (按原文本缓存，词云与情感词频等不同过滤方式共用)
+# 评论分类饼图的关键词匹配方式: False 为子串匹配 (默认); True 为按分词结果整词匹配，避免 "古" 命中 "古怪" 这类短关键词误判
+CATEGORY_MATCH_BY_TOKENS = False
+# 词云图中希望过滤的词 (按子串匹配，词中包含任一过滤词即过滤)
+WORDCLOUD_FILTER_WORDS = ("贺电", "发来贺电", "恭喜")
+OVERALL_WORDCLOUD_FILTER_WORDS = ("贺电", "发来贺电", "恭喜", "大学发来贺电", "学院发来贺电", "职业技术学院发来贺电", "科技大学发来贺电")
+# 情感打分后端: "snownlp" (默认, 逐条打分)、"sklearn" (用SnowNLP自带的正/负面语料训练的朴素贝叶斯, 整批向量化打分)
+# 、"transformers" (中文预训练情感模型批量推理, 有GPU时自动使用)、"lexicon" (按正/负面情感词典计数打分, 最快)
+# 或 "snownlp_fast" (直接使用SnowNLP已训练的贝叶斯模型参数整批向量化打分, 分词改用 jieba, 得分与 snownlp 近似)
+SENTIMENT_BACKEND = "snownlp"
+SENTIMENT_LEXICON_POS_FILE = "sentiment_pos.txt" # lexicon 后端的正面情感词表 (每行一个词, 如 HowNet/BosonNLP 词典)
+SENTIMENT_LEXICON_NEG_FILE = "sentiment_neg.txt" # lexicon 后端的负面情感词表
+# lexicon 后端的带权情感词典 (每行 "词 分值", 如 BosonNLP_sentiment_score.txt)；存在时优先于上面的正/负面词表
+SENTIMENT_LEXICON_SCORE_FILE = "BosonNLP_sentiment_score.txt"
+SENTIMENT_LEXICON_SCORE_SCALE = 5.0 # 带权词典打分时，词分值之和除以该值后经 sigmoid 映射到 0~1
+SKLEARN_SENTIMENT_MODEL_FILE = os.path.join(CACHE_DIR, "sentiment_nb_model.pkl") # 训练一次后缓存，之后直接加载
+TRANSFORMERS_SENTIMENT_MODEL = "uer/roberta-base-finetuned-jd-binary-chinese" # transformers 后端使用的模型
+TRANSFORMERS_BATCH_SIZE = 64 # transformers 后端每批推理的文本数
+API_CACHE_DIR = os.path.join(CACHE_DIR, "api") # 按请求缓存的B站API响应 (视频信息、弹幕分段)；评论页变化频繁，不做缓存
+API_CACHE_TTL = 6 * 3600 # API响应缓存的有效期 (秒)，文件修改时间超过该时长的缓存视为过期并重新请求
+# 情感得分缓存 (文本 -> 得分)，按打分后端及其配置 (词典/模型) 分别保存，文件名见 sentiment_score_cache_file；重复分析同一视频时无需重新打分
+SENTIMENT_SCORE_CACHE_MAX = 200000 # 缓存最多保留的得分条数，超出时只保留最近加入的部分
+REFRESH_FETCHED_DATA = "--refresh" in sys.argv # 命令行传入 --refresh 时忽略已保存的弹幕/评论快照，重新从B站获取
+FETCHED_SNAPSHOT_TTL = 24 * 3600 # 弹幕/评论快照的有效期 (秒)，过期后重新从B站获取
+STOPWORDS_CACHE_FILE = os.path.join(CACHE_DIR, "stopwords.pkl") # 解析后的停用词集合缓存
+JIEBA_CACHE_FILE = os.path.join(CACHE_DIR, "jieba.cache") # jieba 前缀词典缓存，固定路径以便跨运行复用
+JIEBA_USER_DICT_FILE = "userdict.txt" # 弹幕领域用户词典 (网络用语、常见节目相关词)，存在时在启动时加载
+JIEBA_USE_HMM = False # 是否启用 jieba 的 HMM 未登录词识别；关闭后分词约快一倍，领域词由用户词典覆盖
+FONT_PATH_CACHE_FILE = os.path.join(CACHE_DIR, "font_path.txt") # 缓存上次检测到的中文字体路径，避免每次启动重复探测
 
 # --- 新增配置 (传统文化节目专项分析) ---
 TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS = [
@@ -66,18 +165,50 @@ TOP_N_TRADITIONAL_SENTIMENT_WORDS = 10 # 传统文化弹幕典型情感词的Top
 USE_FUZZY_MATCHING_FOR_PROGRAM_FILTER = True  # True: 尝试模糊匹配节目名; False: 使用精确子字符串匹配
 FUZZY_MATCH_THRESHOLD = 80  # 0-100, 模糊匹配的相似度阈值 (建议 75-90)
 
-
+# --- 网络并发配置 ---
+DANMAKU_FETCH_CONCURRENCY = int(os.environ.get("BILI_DANMAKU_CONCURRENCY", 4)) # 同时进行的弹幕分段请求数上限 (过大可能触发B站风控)，可用环境变量调整
+DANMAKU_REQUEST_DELAY_RANGE = (0.2, 0.5) # 每个弹幕分段请求后、释放并发名额前的随机延时范围(秒)
+COMMENT_PREFETCH_BATCH = 4 # 评论总数未知时，每批并发预取的页数
+COMMENT_FETCH_CONCURRENCY = int(os.environ.get("BILI_COMMENT_CONCURRENCY", 4)) # 评论总页数已知时，同时请求的页数上限，可用环境变量调整
+# 评论翻页方式: "page" (默认, 按页码翻页并可并发预取) 或 "cursor" (使用 comment.get_comments_lazy 的 next_offset 游标顺序翻页)
+COMMENT_FETCH_MODE = "page"
+API_MAX_RETRIES = 3 # B站API请求失败时的最大重试次数
+API_RETRY_BACKOFF = 0.3 # 重试退避基数(秒)，第n次重试前等待 backoff * 2**n 秒
+API_RETRYABLE_CODES = (-412, -509) # 值得重试的API错误码 (风控拦截、请求过于频繁)；其他错误码 (如 -404 视频不存在) 直接抛出
+
+
+# 登录方式: "qrcode" (默认, 直接调用B站扫码登录接口，无需启动浏览器) 或 "selenium" (启动Edge浏览器手动登录)
+LOGIN_METHOD = "qrcode"
+QRCODE_LOGIN_TIMEOUT = 180 # 等待扫码确认的最长时间(秒)
+SELENIUM_LOGIN_TIMEOUT = 120 # 浏览器登录时等待登录Cookie出现的最长时间(秒)
+SELENIUM_LOGIN_POLL_INTERVAL = 0.5 # 浏览器登录时检查登录Cookie的间隔(秒)
 EDGE_DRIVER_PATH = None # 例如 "C:/path/to/your/msedgedriver.exe" 或 "/usr/local/bin/msedgedriver"
 COOKIES_FILE = "bilibili_cookies.json"
 CSV_FILE_PATH = "2025年大学生网络春晚文本分析_数据表_2025年大学生春晚节目切片.csv" 
 # 请确保CSV文件与脚本在同一目录，或提供完整路径
 
 # --- 字体路径自动检测与配置 ---
+@functools.lru_cache(maxsize=None)
+def get_matplotlib():
+    """首次调用时导入 matplotlib 并选择非GUI的 Agg 后端 (只输出图片文件，不初始化 Tk/Qt 等图形界面)。"""
+    import matplotlib
+    matplotlib.use("Agg")
+    return matplotlib
+
 def get_font_path_for_os():
     """
     自动检测操作系统并返回一个可用的中文字体路径。
-    如果未找到，则返回 None，并打印警告。
+    优先使用上次运行缓存的路径；如果未找到，则返回 None，并打印警告。
     """
+    try:
+        with open(FONT_PATH_CACHE_FILE, "r", encoding="utf-8") as f:
+            cached_font_path = f.read().strip()
+        if cached_font_path and os.path.exists(cached_font_path):
+            print(f"信息: 使用缓存的字体路径: {cached_font_path}")
+            return cached_font_path
+    except OSError:
+        pass # 缓存不存在或不可读，重新检测
+
     font_path = None
     os_platform = sys.platform
     # print(f"当前操作系统平台: {os_platform}")
@@ -115,8 +246,26 @@ def get_font_path_for_os():
             font_path = font
             print(f"信息: 自动检测到并选用系统字体: {font_path}")
             break
-    
-    if not font_path:
+
+    if not font_path: # 预设路径都不存在时，按字体名在 matplotlib 的字体缓存中查找 (复用全局 fontManager 实例)
+        get_matplotlib()
+        from matplotlib.font_manager import FontProperties, fontManager
+        for font_name_try in ['PingFang SC', 'Songti SC', 'STHeiti', 'SimHei', 'Microsoft YaHei', 'WenQuanYi Micro Hei', 'Noto Sans CJK SC']:
+            try:
+                font_path = fontManager.findfont(FontProperties(family=font_name_try), fallback_to_default=False)
+                print(f"信息: 按字体名 '{font_name_try}' 找到系统字体: {font_path}")
+                break
+            except ValueError: # 未找到该字体
+                continue
+
+    if font_path:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(FONT_PATH_CACHE_FILE, "w", encoding="utf-8") as f:
+                f.write(font_path)
+        except OSError as e:
+            print(f"警告: 写入字体路径缓存 {FONT_PATH_CACHE_FILE} 失败: {e}")
+    else:
         print(f"警告: 在 {os_name} 上未能从预设列表中自动检测到可用的中文字体。")
         print("图表和词云图中的中文可能无法正确显示。")
         print("您可以尝试在脚本顶部手动设置 FONT_PATH 为您系统中的有效中文字体路径。")
@@ -124,6 +273,55 @@ def get_font_path_for_os():
 
 FONT_PATH = get_font_path_for_os() # 动态设置全局字体路径
 
+def configure_matplotlib_font(font_path):
+    """
+    将中文字体文件直接注册到 matplotlib 并放在 font.sans-serif 首位，只在首次绘图前执行一次 (见 get_chart_font)。
+    之后的绘图可直接按名称命中该字体，无需每次重新解析字体文件。返回该字体的 FontProperties，失败时返回 None。
+    """
+    matplotlib = get_matplotlib()
+    from matplotlib.font_manager import FontProperties, fontManager
+    matplotlib.rcParams['axes.unicode_minus'] = False # 正确显示负号
+    if not (font_path and os.path.exists(font_path)):
+        return None
+    try:
+        fontManager.addfont(font_path)
+        font_prop = FontProperties(fname=font_path)
+        font_name = font_prop.get_name()
+    except Exception as e:
+        print(f"警告: 注册字体 '{font_path}' 到 matplotlib 失败: {e}")
+        return None
+    if font_name not in matplotlib.rcParams['font.sans-serif']:
+        matplotlib.rcParams['font.sans-serif'].insert(0, font_name)
+    return font_prop
+
+@functools.lru_cache(maxsize=None)
+def get_chart_font():
+    """
+    返回图表使用的中文字体属性 (全局复用，只解析一次字体文件)：优先为 FONT_PATH 指定的字体；加载失败时尝试系统默认中文字体。
+    结果缓存，备选字体只探测一次，rcParams 也只在此修改一次 (绘图线程中不再修改)。未找到时返回 None。
+    """
+    title_font = configure_matplotlib_font(FONT_PATH)
+    if title_font:
+        return title_font
+    matplotlib = get_matplotlib()
+    from matplotlib.font_manager import FontProperties
+    default_chinese_fonts = ['PingFang SC','Songti SC','STHeiti','SimHei', 'Microsoft YaHei', 'WenQuanYi Micro Hei', 'Noto Sans CJK SC']
+    for font_name_try in default_chinese_fonts:
+        try:
+            test_prop = FontProperties(family=font_name_try) # 尝试使用字体名
+            matplotlib.rcParams['font.sans-serif'].insert(0, test_prop.get_name())
+            # print(f"信息: 饼图使用备选系统字体: {test_prop.get_name()}")
+            return test_prop
+        except Exception: # 如果字体名无效或不存在，会出错
+            # Attempt to remove if added, to prevent issues with invalid font names in rcParams
+            try:
+                if test_prop.get_name() in matplotlib.rcParams['font.sans-serif']:
+                    matplotlib.rcParams['font.sans-serif'].remove(test_prop.get_name())
+            except Exception:
+                pass # Ignore if removal fails or test_prop name is problematic
+    # print(f"警告：未能自动找到可用的中文字体。饼图中的中文可能无法正确显示。")
+    return None
+
 # --- 情感标签映射 ---
 sentiment_label_chinese_map = {
     'positive': '积极',
@@ -132,25 +330,61 @@ sentiment_label_chinese_map = {
 }
 
 # --- 辅助函数 ---
-def time_to_seconds(time_str):
-    """将 HH:MM:SS 或 MM:SS 格式的时间字符串转换为总秒数。"""
-    if not isinstance(time_str, str):
-        if isinstance(time_str, (int, float)):
-             # print(f"警告: 时间值 '{time_str}' 是数字而非字符串，将尝试按秒处理，但这可能不是预期行为。请确保CSV中的时间格式为文本。")
-             return int(time_str) 
-        raise ValueError(f"时间必须是字符串格式, 收到: {time_str} (类型: {type(time_str)})")
-    
-    time_str = time_str.strip() 
-    if time_str.endswith(".0"): 
-        time_str = time_str[:-2]
-
-    parts = list(map(int, time_str.split(':')))
-    if len(parts) == 3: # HH:MM:SS
-        return parts[0] * 3600 + parts[1] * 60 + parts[2]
-    elif len(parts) == 2: # MM:SS
-        return parts[0] * 60 + parts[1]
-    else:
-        raise ValueError(f"无效的时间格式: '{time_str}'. 请使用 HH:MM:SS 或 MM:SS。")
+async def call_with_retry(request_factory, description="B站API"):
+    """
+    调用B站API并在网络错误、超时或限流 (API_RETRYABLE_CODES) 时按指数退避重试。
+    视频不存在/已删除、评论区关闭等API错误码重试也无济于事，直接抛出交给调用方处理。
+    request_factory: 无参函数，每次调用返回一个新的协程 (协程只能await一次)。
+    bilibili_api 在同一事件循环内复用同一个HTTP客户端 (连接池与keep-alive)，此处只负责重试。
+    """
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            return await request_factory()
+        except (ResponseCodeException, NetworkException, httpx.TransportError, asyncio.TimeoutError, OSError) as e:
+            if attempt >= API_MAX_RETRIES or (isinstance(e, ResponseCodeException) and e.code not in API_RETRYABLE_CODES):
+                raise
+            delay = API_RETRY_BACKOFF * (2 ** attempt)
+            print(f"    {description} 请求失败 ({e})，{delay:.1f} 秒后重试 ({attempt + 1}/{API_MAX_RETRIES})...")
+            await asyncio.sleep(delay)
+
+def time_series_to_seconds(time_strs):
+    """
+    将 HH:MM:SS 或 MM:SS 格式的时间字符串列一次性向量化转换为秒数数组。
+    相邻片段的起止时间常常相同，只对去重后的时间字符串做拆分和转换，再按编码映射回各行。
+    """
+    codes, unique_time_strs = pd.factorize(time_strs)
+    parts = pd.Series(unique_time_strs, dtype=object).str.split(':', expand=True).reindex(columns=range(3)).astype(float)
+    unique_seconds = np.where(parts[2].notna(), parts[0] * 3600 + parts[1] * 60 + parts[2], parts[0] * 60 + parts[1]).astype(int)
+    return unique_seconds[codes]
+
+async def cached_api_call(cache_key, request_factory, description="B站API", delay_range=None):
+    """
+    带磁盘缓存的 call_with_retry：响应按 cache_key (可哈希的元组) pickle 到 API_CACHE_DIR。
+    之后的运行在 API_CACHE_TTL 内直接读取缓存，跳过网络请求；缓存过期或指定 --refresh 时重新请求。
+    delay_range: 实际发出网络请求后的随机礼貌性延时范围(秒)，命中缓存时不等待。
+    """
+    cache_path = os.path.join(API_CACHE_DIR, hashlib.md5(repr(cache_key).encode("utf-8")).hexdigest() + ".pkl")
+    if (not REFRESH_FETCHED_DATA and os.path.exists(cache_path)
+            and time.time() - os.path.getmtime(cache_path) <= API_CACHE_TTL):
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"    读取缓存 {cache_path} 失败 ({e})，重新请求{description}。")
+
+    result = await call_with_retry(request_factory, description)
+    if delay_range:
+        await asyncio.sleep(random.uniform(*delay_range))
+    try:
+        os.makedirs(API_CACHE_DIR, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"    写入缓存 {cache_path} 失败: {e}")
+    return result
+
+# 时间轴列的格式 "HH:MM:SS-HH:MM:SS" 或 "MM:SS-MM:SS"，在模块加载时编译一次
+_TIMELINE_RE = re.compile(r'(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(\d{1,2}:\d{2}(?::\d{2})?)')
 
 def load_segments_from_csv(csv_path):
     """从CSV文件加载视频片段定义，使用'时间轴'列解析时间。"""
@@ -174,52 +408,50 @@ def load_segments_from_csv(csv_path):
             return None
 
         print(f"成功读取CSV文件 '{csv_path}'。正在处理行...")
-        time_pattern = re.compile(r'(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(\d{1,2}:\d{2}(?::\d{2})?)')
-
-        for index, row in df.iterrows():
-            segment_name = str(row[segment_name_col]).strip()
-            timeline_str = str(row[timeline_col]).strip()
-            
-            page_index = 0 
-            if page_num_col in df.columns and pd.notna(row[page_num_col]):
-                try:
-                    page_number = int(float(str(row[page_num_col]).strip()))
-                    if page_number >= 1:
-                        page_index = page_number - 1
-                    else:
-                        print(f"警告: 片段 '{segment_name}' のP号 '{row[page_num_col]}' 无效, 将使用默认P1 (page_index 0)。")
-                except ValueError:
-                    print(f"警告: 片段 '{segment_name}' のP号 '{row[page_num_col]}' 不是有效数字, 将使用默认P1 (page_index 0)。")
-            
-            match = time_pattern.search(timeline_str)
-            if not match:
-                print(f"警告: 片段 '{segment_name}' の '时间轴' ('{timeline_str}') 格式不符合预期 (例如 'HH:MM:SS-HH:MM:SS' 或 'MM:SS-MM:SS')。跳过此片段。")
-                continue
-
-            start_time_str = match.group(1)
-            end_time_str = match.group(2)
-            
-            try:
-                start_seconds = time_to_seconds(start_time_str)
-                end_seconds = time_to_seconds(end_time_str)
-            except ValueError as e:
-                print(f"错误: 处理片段 '{segment_name}' の时间格式时出错 (从 '时间轴' 解析出: 开始='{start_time_str}', 结束='{end_time_str}'): {e}。跳过此片段。")
-                continue
-            
-            if end_seconds <= start_seconds:
-                print(f"警告: 片段 '{segment_name}' の结束时间 ({end_time_str}) 不大于开始时间 ({start_time_str})。跳过此片段。")
-                continue
-
-            from_seg = start_seconds // 360 # B站弹幕API按6分钟（360秒）分段
-            to_seg = (end_seconds - 1) // 360 
-
+        # 整列向量化解析，代替 iterrows 逐行处理
+        segment_names = df[segment_name_col].astype(str).str.strip()
+        timeline_strs = df[timeline_col].astype(str).str.strip()
+
+        page_indices = pd.Series(0, index=df.index)
+        if page_num_col in df.columns:
+            raw_page_nums = df[page_num_col]
+            page_numbers = np.trunc(pd.to_numeric(raw_page_nums.astype(str).str.strip(), errors='coerce'))
+            not_numeric = raw_page_nums.notna() & page_numbers.isna()
+            not_positive = page_numbers.notna() & (page_numbers < 1)
+            for segment_name, raw_page_num in zip(segment_names[not_numeric], raw_page_nums[not_numeric]):
+                print(f"警告: 片段 '{segment_name}' のP号 '{raw_page_num}' 不是有效数字, 将使用默认P1 (page_index 0)。")
+            for segment_name, raw_page_num in zip(segment_names[not_positive], raw_page_nums[not_positive]):
+                print(f"警告: 片段 '{segment_name}' のP号 '{raw_page_num}' 无效, 将使用默认P1 (page_index 0)。")
+            valid_pages = page_numbers.notna() & (page_numbers >= 1)
+            page_indices[valid_pages] = page_numbers[valid_pages].astype(int) - 1
+
+        time_matches = timeline_strs.str.extract(_TIMELINE_RE)
+        unmatched = time_matches[0].isna()
+        for segment_name, timeline_str in zip(segment_names[unmatched], timeline_strs[unmatched]):
+            print(f"警告: 片段 '{segment_name}' の '时间轴' ('{timeline_str}') 格式不符合预期 (例如 'HH:MM:SS-HH:MM:SS' 或 'MM:SS-MM:SS')。跳过此片段。")
+
+        matched = time_matches[~unmatched]
+        start_seconds = time_series_to_seconds(matched[0])
+        end_seconds = time_series_to_seconds(matched[1])
+        matched_names = segment_names[~unmatched]
+
+        not_increasing = end_seconds <= start_seconds
+        for segment_name, start_time_str, end_time_str in zip(matched_names[not_increasing], matched[0][not_increasing], matched[1][not_increasing]):
+            print(f"警告: 片段 '{segment_name}' の结束时间 ({end_time_str}) 不大于开始时间 ({start_time_str})。跳过此片段。")
+
+        valid = ~not_increasing
+        from_segs = start_seconds[valid] // 360 # B站弹幕API按6分钟（360秒）分段
+        to_segs = (end_seconds[valid] - 1) // 360
+        # 同名片段以后出现的行为准，与逐行写入字典的行为一致
+        # 各列先整体 tolist() 转为 Python 原生对象，循环中不再逐个装箱 numpy 标量或调用 int()
+        for segment_name, page_index, from_seg, to_seg in zip(matched_names[valid].tolist(), page_indices[~unmatched][valid].tolist(),
+                                                              from_segs.tolist(), to_segs.tolist()):
             segments[segment_name] = {
                 "page_index": page_index,
                 "cid": None, # 将在获取视频信息后填充
                 "from_seg": from_seg,
                 "to_seg": to_seg
             }
-            # print(f"  已加载片段: '{segment_name}', P索引: {page_index}, '时间轴': '{timeline_str}', 开始秒: {start_seconds}, 结束秒: {end_seconds}, from_seg: {from_seg}, to_seg: {to_seg}")
 
     except FileNotFoundError:
         print(f"错误: CSV文件未找到于路径: {csv_path}")
@@ -235,17 +467,32 @@ def load_segments_from_csv(csv_path):
         print(f"警告: 未能从CSV文件 '{csv_path}' 中加载任何有效的片段定义。")
     return segments
 
-# --- Selenium 登录与 Cookie 管理 --- 
-def get_bilibili_credential_via_selenium():
-    """通过Selenium登录B站或加载已保存的Cookies来获取凭证。"""
+# --- 登录与 Cookie 管理 --- 
+def get_bilibili_credential():
+    """加载已保存的Cookies获取凭证；无有效Cookies时按 LOGIN_METHOD 登录 (扫码登录失败时回退到Selenium)。"""
+    credential = load_saved_credential()
+    if credential:
+        return credential
+    if LOGIN_METHOD == "qrcode":
+        credential = get_bilibili_credential_via_qrcode()
+        if credential:
+            return credential
+        print("扫码登录未成功，尝试通过Selenium启动浏览器登录...")
+    return get_bilibili_credential_via_selenium()
+
+def load_saved_credential():
+    """从 COOKIES_FILE 加载已保存的Cookies，有效时返回 Credential，否则返回 None。"""
     loaded_cookies = {}
     if os.path.exists(COOKIES_FILE):
         try:
-            with open(COOKIES_FILE, 'r', encoding='utf-8') as f:
-                loaded_cookies = json.load(f)
+            with open(COOKIES_FILE, 'rb') as f:
+                loaded_cookies = json_loads(f.read())
             # print(f"已从 {COOKIES_FILE} 加载Cookies。")
             if loaded_cookies.get("SESSDATA") and loaded_cookies.get("bili_jct"):
                  # print("检测到有效的SESSDATA和bili_jct，尝试使用已保存的Cookies。")
+                 if not is_saved_login_valid(loaded_cookies):
+                     print("已保存的Cookies登录状态已失效，将重新登录。")
+                     return None
                  return Credential(
                     sessdata=loaded_cookies.get("SESSDATA"),
                     bili_jct=loaded_cookies.get("bili_jct"),
@@ -256,6 +503,97 @@ def get_bilibili_credential_via_selenium():
                 print("加载的Cookies无效或不完整，将尝试重新登录。")
         except Exception as e:
             print(f"加载Cookies文件 {COOKIES_FILE} 失败: {e}。将尝试重新登录。")
+    return None
+
+def is_saved_login_valid(cookies):
+    """
+    用已保存的Cookies请求一次B站导航接口，确认登录状态仍有效 (避免带着过期Cookies跑完整个流程)。
+    只有接口明确返回未登录时才判为失效；网络异常等无法确认的情况按有效处理，不强制重新登录。
+    """
+    headers = {"User-Agent": "Mozilla/5.0", "Referer": "https://www.bilibili.com/"}
+    try:
+        with httpx.Client(headers=headers, cookies={"SESSDATA": cookies["SESSDATA"]}, timeout=10) as client:
+            data = client.get("https://api.bilibili.com/x/web-interface/nav").json()
+        # 未登录时 data 字段可能为 null，按空字典处理
+        return not (data.get('code') == -101 or (data.get('data') or {}).get('isLogin') is False)
+    except Exception as e:
+        print(f"警告: 校验已保存Cookies时请求失败: {e}。将直接使用已保存的Cookies。")
+        return True
+
+def save_cookies(cookies_to_save):
+    """将登录得到的Cookies保存到 COOKIES_FILE，供之后的运行直接使用。"""
+    try:
+        with open(COOKIES_FILE, 'wb') as f:
+            f.write(json_dumps(cookies_to_save))
+        print(f"Cookies已保存到 {COOKIES_FILE}")
+    except Exception as e:
+        print(f"保存Cookies到 {COOKIES_FILE} 时出错: {e}")
+
+def get_bilibili_credential_via_qrcode():
+    """
+    直接调用B站通行证的扫码登录接口获取凭证，无需启动浏览器。
+    在终端显示二维码 (或打印二维码链接)，轮询扫码状态直至确认、过期或超时。
+    """
+    headers = {"User-Agent": "Mozilla/5.0", "Referer": "https://www.bilibili.com/"}
+    try:
+        with httpx.Client(headers=headers, timeout=10) as client:
+            generate_resp = client.get("https://passport.bilibili.com/x/passport-login/web/qrcode/generate").json()
+            qrcode_url = generate_resp.get("data", {}).get("url")
+            qrcode_key = generate_resp.get("data", {}).get("qrcode_key")
+            if not qrcode_url or not qrcode_key:
+                print(f"获取登录二维码失败: {generate_resp.get('message', generate_resp)}")
+                return None
+
+            print("\n请使用B站手机客户端扫描以下二维码并确认登录:")
+            if QRCODE_AVAILABLE:
+                qr = qrcode.QRCode(border=1)
+                qr.add_data(qrcode_url)
+                qr.print_ascii(invert=True)
+            else:
+                print("  (未安装 `qrcode` 库，无法在终端显示二维码。可安装: pip install qrcode)")
+            print(f"二维码链接: {qrcode_url}")
+
+            deadline = time.time() + QRCODE_LOGIN_TIMEOUT
+            while time.time() < deadline:
+                time.sleep(2)
+                poll_data = client.get("https://passport.bilibili.com/x/passport-login/web/qrcode/poll",
+                                       params={"qrcode_key": qrcode_key}).json().get("data", {})
+                poll_code = poll_data.get("code")
+                if poll_code == 0: # 登录成功，Cookies已写入 client
+                    break
+                if poll_code == 86038:
+                    print("二维码已过期。")
+                    return None
+                # 86101: 未扫码; 86090: 已扫码未确认，继续等待
+            else:
+                print(f"等待扫码超时 ({QRCODE_LOGIN_TIMEOUT} 秒)。")
+                return None
+
+            sessdata = client.cookies.get("SESSDATA")
+            bili_jct = client.cookies.get("bili_jct")
+            dedeuserid = client.cookies.get("DedeUserID")
+            buvid3 = client.cookies.get("buvid3")
+    except Exception as e:
+        print(f"扫码登录过程中出错: {e}")
+        return None
+
+    if not (sessdata and bili_jct):
+        print("扫码登录后未能获取到SESSDATA或bili_jct。")
+        return None
+    print("扫码登录成功，已获取SESSDATA和bili_jct。")
+    save_cookies({"SESSDATA": sessdata, "bili_jct": bili_jct, "buvid3": buvid3, "DedeUserID": dedeuserid})
+    return Credential(sessdata=sessdata, bili_jct=bili_jct, buvid3=buvid3, dedeuserid=dedeuserid)
+
+def get_bilibili_credential_via_selenium():
+    """通过Selenium启动Edge浏览器手动登录B站来获取凭证。"""
+    try:
+        from selenium import webdriver
+        from selenium.webdriver.edge.service import Service as EdgeService
+        from selenium.webdriver.edge.options import Options as EdgeOptions
+        from selenium.common.exceptions import WebDriverException
+    except ImportError:
+        print("错误: `selenium` 库未找到，无法通过浏览器登录。请安装: pip install selenium")
+        return None
 
     print("\n重要提示: 在脚本尝试启动Edge进行登录前，请确保已关闭所有正在运行的Microsoft Edge浏览器窗口。")
     print("这有助于避免 'user data directory is already in use' 错误。")
@@ -269,6 +607,7 @@ def get_bilibili_credential_via_selenium():
     edge_options.add_argument("--no-first-run") # 跳过首次运行向导
     edge_options.add_argument("--disable-background-networking") # 禁用后台网络活动
     edge_options.add_argument("--disable-sync") # 禁用同步
+    edge_options.page_load_strategy = 'eager' # DOM 就绪即返回，不等待图片等子资源加载完成
 
     # 创建唯一的user-data-dir以避免冲突
     timestamp = str(int(time.time()))
@@ -316,8 +655,17 @@ def get_bilibili_credential_via_selenium():
 
         print("Edge浏览器已启动。")
         driver.get("https://passport.bilibili.com/login")
-        print("请在打开的浏览器窗口中手动登录Bilibili。脚本将等待60秒以便您完成登录。")
-        time.sleep(60) # 增加等待时间以便用户登录
+        print(f"请在打开的浏览器窗口中手动登录Bilibili。脚本将在检测到登录后继续 (最长等待{SELENIUM_LOGIN_TIMEOUT}秒)。")
+        # 轮询登录Cookie，登录成功即刻继续，而不是固定等待
+        deadline = time.time() + SELENIUM_LOGIN_TIMEOUT
+        while time.time() < deadline:
+            polled_cookies = {c['name']: c['value'] for c in driver.get_cookies() if 'bilibili.com' in c.get('domain', '')}
+            if polled_cookies.get('SESSDATA') and polled_cookies.get('bili_jct'):
+                print("检测到登录成功。")
+                break
+            time.sleep(SELENIUM_LOGIN_POLL_INTERVAL)
+        else:
+            print("等待登录超时。")
         print("尝试获取登录后的Cookies...")
         selenium_cookies = driver.get_cookies()
 
@@ -338,13 +686,7 @@ def get_bilibili_credential_via_selenium():
 
         if sessdata and bili_jct:
             print("成功获取到SESSDATA和bili_jct。")
-            cookies_to_save = {"SESSDATA": sessdata, "bili_jct": bili_jct, "buvid3": buvid3, "DedeUserID": dedeuserid}
-            try:
-                with open(COOKIES_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(cookies_to_save, f, ensure_ascii=False, indent=4)
-                print(f"Cookies已保存到 {COOKIES_FILE}")
-            except Exception as e:
-                print(f"保存Cookies到 {COOKIES_FILE} 时出错: {e}")
+            save_cookies({"SESSDATA": sessdata, "bili_jct": bili_jct, "buvid3": buvid3, "DedeUserID": dedeuserid})
             if driver: driver.quit() # 确保浏览器关闭
             return Credential(sessdata=sessdata, bili_jct=bili_jct, buvid3=buvid3, dedeuserid=dedeuserid)
         else:
@@ -384,119 +726,670 @@ def load_stopwords(filepath="stopwords.txt"):
     """加载停用词列表，如果文件不存在则使用默认列表。"""
     default_stopwords = {"的", "了", "是", "我", "你", "他", "她", "它", "们", "这", "那", "一个", "一些", "什么", "怎么", "这个", "那个", "啊", "吧", "吗", "呢", "哈", "哈哈", "哈哈哈", "哦", "嗯", "草", "一种", "一样", "这样", "那样", "我们", "你们", "他们", "因为", "所以", "而且", "但是", "然而", " ", "\n", "\t"}
     if os.path.exists(filepath):
+        # 停用词表较大时逐行解析较慢：解析结果以 pickle 缓存，停用词文件和脚本 (默认停用词) 均未修改时直接加载
+        try:
+            source_mtime = max(os.path.getmtime(filepath), os.path.getmtime(os.path.abspath(__file__)))
+            if os.path.getmtime(STOPWORDS_CACHE_FILE) >= source_mtime:
+                with open(STOPWORDS_CACHE_FILE, "rb") as f:
+                    return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass # 缓存不存在、已过期或损坏，重新解析
+
         try:
             with open(filepath, "r", encoding="utf-8") as f:
                 custom_stopwords = {line.strip().lower() for line in f if line.strip()}
                 # print(f"已从 {filepath} 加载 {len(custom_stopwords)} 个自定义停用词。")
-                return default_stopwords.union(custom_stopwords)
         except Exception as e:
             print(f"读取停用词文件 {filepath} 时出错: {e}。将使用默认停用词。")
-            return default_stopwords
+            return frozenset(word.lower() for word in default_stopwords)
+
+        stopwords = frozenset(word.lower() for word in default_stopwords.union(custom_stopwords)) # 统一小写一次，过滤时只需对分词结果小写
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(STOPWORDS_CACHE_FILE, "wb") as f:
+                pickle.dump(stopwords, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            print(f"保存停用词缓存 {STOPWORDS_CACHE_FILE} 时出错: {e}")
+        return stopwords
     else:
         # print(f"停用词文件 {filepath} 未找到。将使用默认的基础停用词集合。")
-        return default_stopwords
+        return frozenset(word.lower() for word in default_stopwords)
 
 STOPWORDS = load_stopwords()
 
+# 将 jieba 词典缓存放在固定目录，首次构建后之后的运行直接加载缓存，无需重新解析文本词典
+try:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    jieba.dt.cache_file = os.path.abspath(JIEBA_CACHE_FILE) # jieba 会把相对路径拼接到系统临时目录之后，必须传绝对路径
+except OSError as e:
+    print(f"警告: 无法创建缓存目录 {CACHE_DIR}: {e}。jieba 将使用默认的临时缓存。")
+
+def load_jieba_user_words():
+    """加载用户词典，并把传统文化节目关键词加入词典，使关闭 HMM 后这些词仍能被完整切分。"""
+    if os.path.exists(JIEBA_USER_DICT_FILE):
+        try:
+            jieba.load_userdict(JIEBA_USER_DICT_FILE)
+        except Exception as e:
+            print(f"警告: 加载jieba用户词典 {JIEBA_USER_DICT_FILE} 失败: {e}")
+    for keyword in TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS:
+        jieba.add_word(keyword)
+
+# jieba 首次使用时才加载词典 (约1秒)；在后台线程中提前加载，与登录、获取弹幕等网络等待重叠，分词时词典已就绪
+_jieba_loader = threading.Thread(target=load_jieba_user_words, name="jieba-loader", daemon=True)
+_jieba_loader.start()
+
+def wait_for_jieba():
+    """等待后台的 jieba 词典加载完成 (已完成时立即返回)。分词或 fork 子进程前调用，避免使用未加载完的词典。"""
+    if _jieba_loader.is_alive():
+        _jieba_loader.join()
+
+# 文本清洗用的正则在模块加载时编译一次：URL、@用户、B站表情等中括号内容合并为一个交替模式，每条文本只扫描一遍
+_CLEAN_RE = re.compile(r"http\S+|@\S+|\[.*?\]")
+
+class _KeepCharsTable(dict):
+    """str.translate 查表：中文、英文、数字和空白字符映射为自身，其余映射为 None (删除)。首次遇到的码位按需计算后缓存。"""
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        keep = (0x4E00 <= codepoint <= 0x9FA5) or (char.isascii() and char.isalnum()) or char.isspace()
+        value = codepoint if keep else None
+        self[codepoint] = value
+        return value
+
+_KEEP_CHARS_TABLE = _KeepCharsTable()
+
+_UNSAFE_FILENAME_CHARS = '\\/*?:"<>|'
+_FILENAME_SAFE_TABLE = str.maketrans(_UNSAFE_FILENAME_CHARS, "_" * len(_UNSAFE_FILENAME_CHARS)) # 文件名中的非法字符替换为下划线
+
+def clean_text(text):
+    """移除URL、提及、表情，仅保留中英数和空白字符。"""
+    # 一次替换同时移除URL、@用户和B站表情等中括号内容
+    text = _CLEAN_RE.sub("", text)
+    # 仅保留中文、英文、数字和空格，移除其他特殊符号 (str.translate 在C层逐字符查表，比正则替换快)
+    text = text.translate(_KEEP_CHARS_TABLE)
+    return text.strip()
+
+def filter_tokens(seg_list, custom_filter_words=None):
+    """对分词结果去停用词、单字和自定义过滤词。"""
+    # 过滤单字和停用词（通常单个字意义不大，除非特定场景）
+    # 先做最廉价的长度判断，多数单字词在此即被排除，不再进入后续的字符串操作
+    if not custom_filter_words:
+        return [word for word in seg_list if len(word) > 1 and word.strip() and word.lower() not in STOPWORDS]
+
+    # 同时过滤自定义词（通常用于词云图，避免某些词语过多出现），在同一遍推导式中完成，不再生成中间列表
+    # 每个词只调用一次 lower()，结果同时用于停用词和自定义过滤词的判断
+    custom_filter_search = get_custom_filter_regex(make_filter_key(custom_filter_words)).search
+    return [
+        word for word in seg_list
+        if len(word) > 1 and word.strip() and (word_lower := word.lower()) not in STOPWORDS
+        and not custom_filter_search(word_lower)
+    ]
+
+def make_filter_key(custom_filter_words):
+    """将自定义过滤词列表转为可哈希的规范形式 (小写、去重、排序)，同一组过滤词只编译一次正则。"""
+    return tuple(sorted({cfw.lower() for cfw in custom_filter_words})) if custom_filter_words else ()
+
+@functools.lru_cache(maxsize=None)
+def get_custom_filter_regex(custom_filter_words):
+    """
+    将自定义过滤词编译为一个交替正则并缓存 (每组过滤词只编译一次)。
+    保持“词中包含任一过滤词即过滤”的子串语义，一次 search 代替对每个过滤词逐一做子串判断。
+    包含其他过滤词的长词 (如已有 "贺电" 时的 "发来贺电") 必然同时命中短词，直接从交替分支中去掉。
+    """
+    lowered = {cfw.lower() for cfw in custom_filter_words if cfw}
+    patterns = sorted(cfw for cfw in lowered if not any(other != cfw and other in cfw for other in lowered))
+    return re.compile("|".join(map(re.escape, patterns)))
+
+_lac_segmenter = None # 进程内缓存已加载的 LAC 分词器
+
+def get_lac_segmenter():
+    """加载百度 LAC 分词器 (C++实现, 支持整批分词)；未安装或加载失败时返回 None，回退到 jieba。"""
+    global _lac_segmenter, SEGMENTER
+    if _lac_segmenter is None and SEGMENTER == "lac":
+        try:
+            from LAC import LAC
+            _lac_segmenter = LAC(mode='seg')
+        except Exception as e: # 包括 ImportError
+            print(f"警告: 加载 LAC 分词器失败 ({e})，将回退到 jieba。若需此功能, 请安装: pip install lac")
+            SEGMENTER = "jieba" # 只提示一次
+    return _lac_segmenter
+
+def segment_text(text):
+    """按 SEGMENTER 对单条已清洗文本分词。"""
+    lac = get_lac_segmenter()
+    if lac is not None:
+        return lac.run(text)
+    # 使用精确模式进行分词
+    wait_for_jieba()
+    return jieba.lcut(text, cut_all=False, HMM=JIEBA_USE_HMM)
+
+_segmentation_cache = {} # 原文本 -> 清洗并分词后的词元组 (未经过滤)，带/不带过滤词的预处理共用同一次分词
+
+def clean_and_segment(text):
+    """
+    清洗并分词单条文本，返回未经过滤的词元组。
+    需定义在模块顶层，以便进程池将其pickle后分发给子进程。
+    """
+    text = clean_text(text)
+    if not text:
+        return ()
+    return tuple(segment_text(text))
+
+def segment_texts(texts):
+    """
+    对一批 (已去重的) 文本清洗并分词，返回与 texts 一一对应的词元组列表。
+    LAC 分词器可用时整批交给 LAC；文本量较大且为POSIX系统时，将所有文本以换行拼接后交给 jieba 并行模式分词
+    (jieba.enable_parallel 只对单次 jieba.cut 的多行输入生效)，再按换行符拆回各条文本；其他平台则用进程池并行分词。
+    """
+    lac = get_lac_segmenter()
+    if lac is not None and len(texts) > 1:
+        # LAC 接受文本列表，在C++中整批分词，省去逐条调用的Python开销 (空文本不送入分词器)
+        cleaned_by_text = {text: clean_text(text) for text in texts}
+        non_empty = [cleaned for cleaned in dict.fromkeys(cleaned_by_text.values()) if cleaned]
+        tokens_by_cleaned = {cleaned: tuple(tokens) for cleaned, tokens in zip(non_empty, lac.run(non_empty))}
+        return [tokens_by_cleaned.get(cleaned_by_text[text], ()) for text in texts]
+
+    if JIEBA_PARALLEL_WORKERS <= 1 or len(texts) < JIEBA_PARALLEL_MIN_TEXTS:
+        return [clean_and_segment(text) for text in texts]
+
+    wait_for_jieba() # 子进程需继承完整加载的词典
+
+    if os.name != "posix" or not hasattr(jieba, "enable_parallel"):
+        # Windows 等不支持 jieba 并行模式的平台：用进程池对文本分别分词
+        with multiprocessing.Pool(JIEBA_PARALLEL_WORKERS) as pool:
+            return pool.map(clean_and_segment, texts, chunksize=JIEBA_POOL_CHUNKSIZE)
+
+    # 文本内部的空白统一折叠为单个空格，保证换行符只出现在文本之间
+    cleaned_lines = [" ".join(clean_text(text).split()) for text in texts]
+    jieba.initialize() # 在父进程中加载词典，fork 出的分词进程直接继承，无需各自重复加载
+    jieba.enable_parallel(JIEBA_PARALLEL_WORKERS)
+    try:
+        tokens_per_text = [[]]
+        for word in jieba.cut("\n".join(cleaned_lines), cut_all=False, HMM=JIEBA_USE_HMM):
+            if word == "\n":
+                tokens_per_text.append([])
+            else:
+                tokens_per_text[-1].append(word)
+    finally:
+        jieba.disable_parallel() # 关闭分词进程池，避免影响之后创建的其他进程池
+    return [tuple(tokens) for tokens in tokens_per_text]
+
+def segment_texts_cached(unique_texts):
+    """
+    返回 {文本: 词元组}。弹幕中大量重复文本 (如“哈哈哈”、刷屏) 以及词云与情感词频两条分析路径中的同一文本只分词一次，
+    之前分过词的文本直接取缓存，其余文本整批交给 segment_texts。
+    """
+    tokens_by_text = {text: _segmentation_cache[text] for text in unique_texts if text in _segmentation_cache}
+    pending = [text for text in unique_texts if text not in tokens_by_text]
+    if pending:
+        new_tokens = dict(zip(pending, segment_texts(pending)))
+        tokens_by_text.update(new_tokens)
+        if len(_segmentation_cache) + len(new_tokens) > PREPROCESS_CACHE_SIZE:
+            _segmentation_cache.clear() # 超出上限时整体清空，避免缓存无限增长
+        _segmentation_cache.update(new_tokens)
+    return tokens_by_text
+
 def preprocess_text(text, custom_filter_words=None):
     """预处理文本：移除URL、提及、表情，保留中英数空格，分词，去停用词和自定义过滤词。"""
-    # 移除URL
-    text = re.sub(r"http\S+", "", text)
-    # 移除@用户
-    text = re.sub(r"@\S+", "", text)
-    # 移除B站表情等中括号内容
-    text = re.sub(r"\[.*?\]", "", text)
-    # 仅保留中文、英文、数字和空格，移除其他特殊符号
-    text = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9\s]", "", text)
-    text = text.strip()
+    return preprocess_texts([text], custom_filter_words)[0]
 
-    if not text:
-        return []
+_filtered_tokens_cache = {} # 过滤词组合 (make_filter_key) -> {原文本: 过滤后的词元组}，各分析阶段对同一文本重复预处理时直接复用
 
-    # 使用精确模式进行分词
-    seg_list = jieba.lcut(text, cut_all=False)
+def preprocess_texts(texts, custom_filter_words=None):
+    """
+    批量预处理文本，返回与 texts 一一对应的词列表。
+    重复文本只分词、过滤一次；之前按同一组过滤词预处理过的文本 (如总体、类别、传统文化节目等多次分析中的同一评论/弹幕) 直接取缓存。
+    """
+    filter_key = make_filter_key(custom_filter_words)
+    filtered_by_text = _filtered_tokens_cache.setdefault(filter_key, {})
+    unique_texts = list(dict.fromkeys(texts))
+    words_by_text = {text: filtered_by_text[text] for text in unique_texts if text in filtered_by_text}
+    pending = [text for text in unique_texts if text not in words_by_text]
+    if pending:
+        tokens_by_text = segment_texts_cached(pending)
+        new_words = {text: tuple(filter_tokens(tokens_by_text[text], filter_key)) for text in pending}
+        words_by_text.update(new_words)
+        if len(filtered_by_text) + len(new_words) > PREPROCESS_CACHE_SIZE:
+            filtered_by_text.clear() # 与分词缓存相同的上限策略
+        filtered_by_text.update(new_words)
+    return [list(words_by_text[text]) for text in texts]
 
-    # 过滤停用词和单字（通常单个字意义不大，除非特定场景）
-    words_after_stopwords = [
-        word for word in seg_list
-        if word.strip() and word.lower() not in STOPWORDS and len(word) > 1 
-    ]
+# --- 新增：情感分析与高频词提取辅助函数 ---
+def snownlp_score(text):
+    """
+    计算单条文本的SnowNLP情感得分 (0~1)。出错时返回0.5，即归为中性。
+    需定义在模块顶层，以便多进程池将其pickle后分发给子进程。
+    """
+    try:
+        # 直接调用模块级的情感分类器 (SnowNLP(text).sentiments 内部同样调用它)，省去每条文本构造 SnowNLP 对象的开销
+        return snownlp_sentiment.classify(text)
+    except Exception:
+        # print(f"SnowNLP处理文本 '{text[:20]}...' 时出错，暂归为中性。")
+        return 0.5
 
-    # 过滤自定义词（通常用于词云图，避免某些词语过多出现）
-    if custom_filter_words:
-        custom_filter_lower = [cfw.lower() for cfw in custom_filter_words]
-        final_filtered_words = [
-            word for word in words_after_stopwords
-            if not any(cfw_lower in word.lower() for cfw_lower in custom_filter_lower)
-        ]
+def get_sentiment_pool_context():
+    """
+    返回创建情感打分进程池所用的多进程上下文。
+    SnowNLP 在导入时即从 marshal 文件加载情感模型；除 Windows 外优先使用 fork 启动子进程，
+    使子进程以写时复制方式直接继承父进程中已加载的模型，而不是每个子进程各自重新加载一遍。
+    """
+    if sys.platform != "win32" and "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def sentiment_tokenize(text):
+    """情感模型使用的分词函数 (不去停用词，保留否定词等情感线索)。"""
+    wait_for_jieba()
+    return jieba.lcut(text)
+
+def make_sentiment_vectorizer():
+    """HashingVectorizer 无状态，无需随模型保存，每次按相同参数重建即可。"""
+    return HashingVectorizer(tokenizer=sentiment_tokenize, token_pattern=None, lowercase=False,
+                             n_features=2**18, alternate_sign=False, norm=None)
+
+_sklearn_sentiment_model = None # 进程内缓存已加载的朴素贝叶斯模型
+
+def get_sklearn_sentiment_model():
+    """
+    加载 (或首次训练并缓存) 基于SnowNLP正/负面语料的朴素贝叶斯情感模型。
+    scikit-learn 不可用或训练失败时返回 None。
+    """
+    global _sklearn_sentiment_model
+    if _sklearn_sentiment_model is not None:
+        return _sklearn_sentiment_model
+    if not SKLEARN_AVAILABLE:
+        print("警告: `scikit-learn` 库未找到，情感打分将回退到 SnowNLP。若需此功能, 请安装: pip install scikit-learn")
+        return None
+
+    if os.path.exists(SKLEARN_SENTIMENT_MODEL_FILE):
+        try:
+            with open(SKLEARN_SENTIMENT_MODEL_FILE, "rb") as f:
+                _sklearn_sentiment_model = pickle.load(f)
+            return _sklearn_sentiment_model
+        except Exception as e:
+            print(f"加载情感模型缓存 {SKLEARN_SENTIMENT_MODEL_FILE} 失败: {e}。将重新训练。")
+
+    try:
+        corpus_dir = os.path.dirname(snownlp_sentiment.__file__)
+        texts, labels = [], []
+        for corpus_name, label in (("neg.txt", 0), ("pos.txt", 1)):
+            with open(os.path.join(corpus_dir, corpus_name), "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        texts.append(line.strip())
+                        labels.append(label)
+        print(f"正在使用SnowNLP语料 ({len(texts)} 条) 训练向量化情感模型 (仅首次运行需要)...")
+        model = MultinomialNB()
+        model.fit(make_sentiment_vectorizer().transform(texts), labels)
+    except Exception as e:
+        print(f"训练情感模型时出错: {e}。情感打分将回退到 SnowNLP。")
+        return None
+
+    try:
+        ensure_dir(CACHE_DIR)
+        with open(SKLEARN_SENTIMENT_MODEL_FILE, "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"保存情感模型缓存 {SKLEARN_SENTIMENT_MODEL_FILE} 时出错: {e}")
+    _sklearn_sentiment_model = model
+    return model
+
+_transformers_sentiment_pipeline = None # 进程内缓存已加载的 transformers 情感分析流水线
+
+def get_transformers_sentiment_pipeline():
+    """
+    加载 transformers 情感分析流水线 (首次运行会下载模型)。
+    transformers 体积较大，仅在选用该后端时才导入；不可用或加载失败时返回 None。
+    """
+    global _transformers_sentiment_pipeline
+    if _transformers_sentiment_pipeline is not None:
+        return _transformers_sentiment_pipeline
+    try:
+        import torch
+        from transformers import pipeline
+    except ImportError:
+        print("警告: `transformers` 或 `torch` 库未找到，情感打分将回退到 SnowNLP。若需此功能, 请安装: pip install transformers torch")
+        return None
+
+    try:
+        print(f"正在加载情感模型 {TRANSFORMERS_SENTIMENT_MODEL} ...")
+        _transformers_sentiment_pipeline = pipeline(
+            "sentiment-analysis", model=TRANSFORMERS_SENTIMENT_MODEL,
+            device=0 if torch.cuda.is_available() else -1, batch_size=TRANSFORMERS_BATCH_SIZE, truncation=True
+        )
+    except Exception as e:
+        print(f"加载情感模型 {TRANSFORMERS_SENTIMENT_MODEL} 时出错: {e}。情感打分将回退到 SnowNLP。")
+        return None
+    return _transformers_sentiment_pipeline
+
+_snownlp_bayes_weights = None # 进程内缓存从SnowNLP情感模型中提取的 (词权重, 未登录词权重, 先验项)
+
+def get_snownlp_bayes_weights():
+    """
+    从SnowNLP已加载的朴素贝叶斯情感模型中提取每个词的 正/负 对数概率比，返回 (词->权重 dict, 未登录词权重, 先验项)。
+    SnowNLP 的情感得分等于 sigmoid(先验项 + 各词权重之和)，据此可整批向量化计算，不必逐条运行其纯Python的分类循环。
+    模型结构不符合预期时返回 None。
+    """
+    global _snownlp_bayes_weights
+    if _snownlp_bayes_weights is not None:
+        return _snownlp_bayes_weights
+    try:
+        bayes = snownlp_sentiment.classifier.classifier
+        pos_prob, neg_prob = bayes.d['pos'], bayes.d['neg']
+        pos_total, neg_total = pos_prob.getsum(), neg_prob.getsum()
+        # 加一平滑：未登录词在两类中的概率分别为 1/pos_total 与 1/neg_total
+        unknown_weight = math.log(neg_total) - math.log(pos_total)
+        weights = {word: math.log(pos_prob.freq(word)) - math.log(neg_prob.freq(word))
+                   for word in pos_prob.d.keys() | neg_prob.d.keys()}
+    except Exception as e:
+        print(f"警告: 读取SnowNLP情感模型参数失败: {e}。情感打分将回退到 SnowNLP。")
+        return None
+    _snownlp_bayes_weights = (weights, unknown_weight, -unknown_weight) # 先验项 log(pos_total) - log(neg_total)
+    return _snownlp_bayes_weights
+
+def snownlp_bayes_scores(texts, weights, unknown_weight, prior):
+    """用提取出的SnowNLP贝叶斯参数整批计算情感得分：所有词的权重拼成一个数组，按文本分段求和后统一做 sigmoid。"""
+    from snownlp import normal as snownlp_normal
+    token_lists = [snownlp_normal.filter_stop(sentiment_tokenize(text)) for text in texts] # 与SnowNLP相同，先去停用词
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    token_weights = np.fromiter((weights.get(token, unknown_weight) for tokens in token_lists for token in tokens),
+                                dtype=np.float64, count=int(lengths.sum()))
+    cumulative = np.concatenate(([0.0], np.cumsum(token_weights)))
+    ends = np.cumsum(lengths)
+    logits = prior + cumulative[ends] - cumulative[ends - lengths]
+    return (1.0 / (1.0 + np.exp(-np.clip(logits, -500, 500)))).tolist()
+
+_sentiment_lexicon = None # 进程内缓存已加载的 (正面词集合, 负面词集合)
+
+def get_sentiment_lexicon():
+    """加载正/负面情感词表，返回 (正面词 frozenset, 负面词 frozenset)；词表文件缺失或读取失败时返回 None。"""
+    global _sentiment_lexicon
+    if _sentiment_lexicon is not None:
+        return _sentiment_lexicon
+    lexicon = []
+    for filepath in (SENTIMENT_LEXICON_POS_FILE, SENTIMENT_LEXICON_NEG_FILE):
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                lexicon.append(frozenset(line.strip() for line in f if line.strip()))
+        except OSError as e:
+            print(f"警告: 读取情感词表 {filepath} 失败: {e}。情感打分将回退到 SnowNLP。")
+            return None
+    _sentiment_lexicon = tuple(lexicon)
+    return _sentiment_lexicon
+
+_sentiment_score_lexicon = None # 进程内缓存已加载的带权情感词典 {词: 分值}
+
+def get_sentiment_score_lexicon():
+    """加载带权情感词典 (每行 "词 分值")；文件不存在或读取失败时返回 None，改用正/负面词表。"""
+    global _sentiment_score_lexicon
+    if _sentiment_score_lexicon is not None:
+        return _sentiment_score_lexicon
+    if not os.path.exists(SENTIMENT_LEXICON_SCORE_FILE):
+        return None
+    weights = {}
+    try:
+        with open(SENTIMENT_LEXICON_SCORE_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+                try:
+                    weights[parts[0]] = float(parts[1])
+                except ValueError:
+                    continue
+    except OSError as e:
+        print(f"警告: 读取带权情感词典 {SENTIMENT_LEXICON_SCORE_FILE} 失败: {e}")
+        return None
+    _sentiment_score_lexicon = weights
+    return weights
+
+def weighted_lexicon_score(tokens, weights):
+    """累加各词的情感分值，经 sigmoid 映射到 0~1，无情感词时为0.5 (中性)。"""
+    total = sum(weights.get(token, 0.0) for token in tokens)
+    return 1.0 / (1.0 + math.exp(-total / SENTIMENT_LEXICON_SCORE_SCALE))
+
+def lexicon_score(tokens, positive_words, negative_words):
+    """按正/负面情感词出现次数打分：(正-负)/(正+负+1) 映射到 0~1，无情感词时为0.5 (中性)。"""
+    positive_count = sum(1 for token in tokens if token in positive_words)
+    negative_count = sum(1 for token in tokens if token in negative_words)
+    return 0.5 + 0.5 * (positive_count - negative_count) / (positive_count + negative_count + 1)
+
+def compute_sentiment_scores(texts):
+    """按 SENTIMENT_BACKEND 为文本列表计算情感得分 (0~1，越大越积极)，返回与输入顺序一致的列表。"""
+    if not texts:
+        return []
+    if SENTIMENT_BACKEND == "sklearn":
+        model = get_sklearn_sentiment_model()
+        if model is not None:
+            # 整批文本一次性转为稀疏矩阵，由 predict_proba 做矩阵运算，替代逐条Python循环
+            positive_col = list(model.classes_).index(1)
+            return model.predict_proba(make_sentiment_vectorizer().transform(texts))[:, positive_col].tolist()
+    elif SENTIMENT_BACKEND == "transformers":
+        classifier = get_transformers_sentiment_pipeline()
+        if classifier is not None:
+            # 模型输出 正面/负面 标签及其置信度，统一换算为"积极概率"，沿用现有的分类阈值
+            return [result['score'] if result['label'].lower().startswith('positive') else 1 - result['score']
+                    for result in classifier(texts)]
+    elif SENTIMENT_BACKEND == "snownlp_fast":
+        bayes_weights = get_snownlp_bayes_weights()
+        if bayes_weights is not None:
+            return snownlp_bayes_scores(texts, *bayes_weights)
+    elif SENTIMENT_BACKEND == "lexicon":
+        weights = get_sentiment_score_lexicon()
+        if weights is not None:
+            # 每条文本只需分词并查表累加分值，按词的情感强度加权
+            return [weighted_lexicon_score(sentiment_tokenize(text), weights) for text in texts]
+        lexicon = get_sentiment_lexicon()
+        if lexicon is not None:
+            # 只需分词和集合查找，无需逐条运行贝叶斯模型 (使用不去停用词/单字的分词结果，保留“好”“赞”等情感词)
+            positive_words, negative_words = lexicon
+            return [lexicon_score(sentiment_tokenize(text), positive_words, negative_words) for text in texts]
+
+    global _sentiment_fallback_used
+    if SENTIMENT_BACKEND != "snownlp":
+        _sentiment_fallback_used = True # 所配置的后端不可用，得分来自 SnowNLP，不应存入该后端的得分缓存
+    # SnowNLP 是纯Python的CPU密集计算，文本量大时分发到多个进程并行打分
+    # 使用有序的 imap 而非 imap_unordered，保证得分与文本一一对应
+    if SENTIMENT_WORKERS > 1 and len(texts) >= SENTIMENT_PARALLEL_MIN_TEXTS:
+        snownlp_score("预热") # 在父进程中预热模型与分词缓存，fork出的子进程可直接复用
+        wait_for_jieba() # 不在后台线程加载词典的中途 fork
+        with get_sentiment_pool_context().Pool(SENTIMENT_WORKERS) as pool:
+            return list(pool.imap(snownlp_score, texts, chunksize=SENTIMENT_POOL_CHUNKSIZE))
+    return [snownlp_score(text) for text in texts]
+
+_sentiment_score_cache = {} # 去除首尾空白后的文本 -> 情感得分，同一文本在总体、各类别、各片段的分析中只打分一次
+
+def score_texts(texts):
+    """
+    返回与 texts 一一对应的情感得分。重复文本 (B站评论/弹幕中很常见，常只差首尾空格/换行) 和之前已打过分的文本直接取缓存，
+    只把从未见过的文本去重后交给 compute_sentiment_scores。
+    """
+    keys = [text.strip() for text in texts]
+    missing_keys = [key for key in dict.fromkeys(keys) if key not in _sentiment_score_cache]
+    if missing_keys:
+        _sentiment_score_cache.update(zip(missing_keys, compute_sentiment_scores(missing_keys)))
+    return [_sentiment_score_cache[key] for key in keys]
+
+_sentiment_fallback_used = False # 本次运行中是否有文本因所配置的后端不可用而改由 SnowNLP 打分
+_persisted_sentiment_score_count = 0 # 从磁盘加载的得分条数，没有新增得分时结束时不必重写缓存文件
+_loaded_sentiment_score_cache_file = None # 得分缓存加载自哪个文件
+
+def file_fingerprint(filepath):
+    """文件路径及其修改时间，文件不存在时记为 missing。"""
+    try:
+        return f"{os.path.abspath(filepath)}@{os.path.getmtime(filepath)}"
+    except OSError:
+        return f"{os.path.abspath(filepath)}@missing"
+
+def sentiment_score_cache_file():
+    """
+    情感得分缓存的文件路径：以打分后端命名，并附上影响得分的配置指纹
+    (词典文件及修改时间、分值缩放系数、模型名或模型文件修改时间)，词典/模型变化后不会误用旧得分。
+    """
+    if SENTIMENT_BACKEND == "lexicon":
+        if os.path.exists(SENTIMENT_LEXICON_SCORE_FILE):
+            fingerprint = (file_fingerprint(SENTIMENT_LEXICON_SCORE_FILE), SENTIMENT_LEXICON_SCORE_SCALE)
+        else:
+            fingerprint = (file_fingerprint(SENTIMENT_LEXICON_POS_FILE), file_fingerprint(SENTIMENT_LEXICON_NEG_FILE))
+    elif SENTIMENT_BACKEND == "sklearn":
+        fingerprint = (file_fingerprint(SKLEARN_SENTIMENT_MODEL_FILE),)
+    elif SENTIMENT_BACKEND == "transformers":
+        fingerprint = (TRANSFORMERS_SENTIMENT_MODEL,)
     else:
-        final_filtered_words = words_after_stopwords
+        fingerprint = ()
+    digest = hashlib.md5(repr(fingerprint).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"sentiment_scores_{SENTIMENT_BACKEND}_{digest}.pkl")
+
+def load_sentiment_score_cache():
+    """读取上次运行保存的情感得分缓存，合并到 _sentiment_score_cache。文件不存在或损坏时忽略。"""
+    global _persisted_sentiment_score_count, _loaded_sentiment_score_cache_file
+    cache_file = sentiment_score_cache_file()
+    if not os.path.exists(cache_file):
+        return
+    try:
+        with open(cache_file, "rb") as f:
+            _sentiment_score_cache.update(pickle.load(f))
+        _persisted_sentiment_score_count = len(_sentiment_score_cache)
+        _loaded_sentiment_score_cache_file = cache_file
+        print(f"已加载 {_persisted_sentiment_score_count} 条情感得分缓存。")
+    except Exception as e:
+        print(f"读取情感得分缓存 {cache_file} 失败: {e}。将重新打分。")
 
-    return final_filtered_words
+def save_sentiment_score_cache():
+    """有新增得分时，将情感得分缓存写回磁盘供之后的运行复用 (最多保留 SENTIMENT_SCORE_CACHE_MAX 条最近的得分)。"""
+    if len(_sentiment_score_cache) == _persisted_sentiment_score_count:
+        return
+    if _sentiment_fallback_used:
+        print(f"情感打分后端 {SENTIMENT_BACKEND} 不可用，本次得分来自 SnowNLP，不保存情感得分缓存。")
+        return
+    cache_file = sentiment_score_cache_file()
+    if _loaded_sentiment_score_cache_file and cache_file != _loaded_sentiment_score_cache_file:
+        print("情感词典/模型在本次运行中发生变化，不保存情感得分缓存。")
+        return
+    scores_to_save = _sentiment_score_cache
+    if len(scores_to_save) > SENTIMENT_SCORE_CACHE_MAX:
+        # dict 保持插入顺序，丢弃最早加入的得分
+        scores_to_save = dict(islice(scores_to_save.items(), len(scores_to_save) - SENTIMENT_SCORE_CACHE_MAX, None))
+    try:
+        ensure_dir(CACHE_DIR)
+        with open(cache_file, "wb") as f:
+            pickle.dump(scores_to_save, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"保存情感得分缓存 {cache_file} 时出错: {e}")
+
+def sentiment_masks(scores):
+    """一次性比较整组得分，返回 (积极, 中立, 消极) 三个布尔掩码，代替逐条 if/elif 分支。"""
+    scores_arr = np.asarray(scores, dtype=np.float64)
+    positive_mask = scores_arr > 0.65 # 阈值可调整
+    negative_mask = scores_arr < 0.35 # 阈值可调整
+    neutral_mask = ~(positive_mask | negative_mask)
+    return positive_mask, neutral_mask, negative_mask
 
-# --- 新增：情感分析与高频词提取辅助函数 ---
 def classify_texts_by_sentiment(texts_list):
     """将文本列表按情感分类 (积极, 中立, 消极)"""
     categorized_texts = {'positive': [], 'neutral': [], 'negative': []}
     if not texts_list:
         return categorized_texts
-        
-    for text in texts_list:
-        if not text or not text.strip():
-            continue
-        try:
-            s = SnowNLP(text)
-            score = s.sentiments
-            if score > 0.65: # 阈值可调整
-                categorized_texts['positive'].append(text)
-            elif score < 0.35: # 阈值可调整
-                categorized_texts['negative'].append(text)
-            else:
-                categorized_texts['neutral'].append(text)
-        except Exception as e:
-            # print(f"SnowNLP处理文本 '{text[:20]}...' 时出错: {e}，跳过此条。")
-            categorized_texts['neutral'].append(text) # 出错时暂归为中性
+
+    valid_texts = [text for text in texts_list if text and text.strip()]
+    positive_mask, neutral_mask, negative_mask = sentiment_masks(score_texts(valid_texts))
+    categorized_texts['positive'] = list(compress(valid_texts, positive_mask))
+    categorized_texts['negative'] = list(compress(valid_texts, negative_mask))
+    categorized_texts['neutral'] = list(compress(valid_texts, neutral_mask))
     return categorized_texts
 
+def count_tokens(token_lists):
+    """
+    统计多条文本分词结果的词频。
+    展平后一次性交给 Counter，由其 C 实现的计数循环单趟完成，既不拼接中间的全量词列表，也不逐条调用 update。
+    """
+    return Counter(chain.from_iterable(token_lists))
+
+
+def drop_filtered_words(word_counts, custom_filter_words):
+    """从词频中剔除包含任一自定义过滤词的词 (与 preprocess_texts 的过滤语义一致)，每个不同的词只判断一次。"""
+    filter_key = make_filter_key(custom_filter_words)
+    if not filter_key:
+        return word_counts
+    filter_search = get_custom_filter_regex(filter_key).search
+    return Counter({word: count for word, count in word_counts.items() if not filter_search(word.lower())})
+
+
+def top_n_from_counter(word_counts, top_n):
+    """
+    等价于 word_counts.most_common(top_n) (同频词按插入顺序排列)。
+    词表较大时用 np.partition 在C层找出第 top_n 大的词频作为门槛，只对门槛以上的少量词排序，代替 Python 层的堆操作。
+    """
+    if not 0 < top_n < len(word_counts) or len(word_counts) < 1000: # 词表较小时 numpy 的转换开销不划算
+        return word_counts.most_common(top_n)
+    words = list(word_counts)
+    counts = np.fromiter(word_counts.values(), dtype=np.int64, count=len(words))
+    threshold = np.partition(counts, -top_n)[-top_n]
+    above = np.flatnonzero(counts > threshold)
+    ties = np.flatnonzero(counts == threshold)[:top_n - len(above)] # 与门槛同频的词按插入顺序取足 top_n 个
+    selected = np.sort(np.concatenate((above, ties)))
+    selected = selected[np.argsort(-counts[selected], kind="stable")]
+    return [(words[i], int(counts[i])) for i in selected.tolist()]
+
+
 def get_top_n_words(texts_for_sentiment, top_n):
     """从给定情感类别的文本列表中提取高频词"""
     if not texts_for_sentiment:
         return []
     
-    all_words = []
-    for text in texts_for_sentiment:
-        # 对于情感词频分析，通常不过滤如“贺电”这类词，除非有特殊需求
-        # preprocess_text 的 custom_filter_words 参数在此处为 None
-        all_words.extend(preprocess_text(text)) 
-                                           
-    if not all_words:
-        return []
-        
-    word_counts = Counter(all_words)
-    return word_counts.most_common(top_n)
+    # 对于情感词频分析，通常不过滤如“贺电”这类词，除非有特殊需求
+    # preprocess_texts 的 custom_filter_words 参数在此处为 None
+    word_counts = count_tokens(preprocess_texts(texts_for_sentiment))
+
+    # 只取前 n 个，不对全部词频排序
+    return top_n_from_counter(word_counts, top_n)
 
 
 # --- 弹幕处理 ---
 async def fetch_and_save_danmaku(video_obj, segments_config, credential_obj):
     """获取并保存视频各片段的弹幕。"""
     segmented_danmaku_data = {} # 存储每个片段的弹幕文本列表
-    all_danmaku_texts_combined = [] # 存储所有片段合并后的弹幕文本
     print("正在获取弹幕...")
 
-    video_info_data = await video_obj.get_info() # 获取视频信息，包括各P的CID
+    video_info_data = await cached_api_call(("video_info", video_obj.get_bvid()), lambda: video_obj.get_info(), "获取视频信息") # 获取视频信息，包括各P的CID
     pages_info = video_info_data.get('pages', [])
 
     if not segments_config: # segments_config 来自CSV
         print("错误：视频片段定义 (segments_config) 为空。请检查CSV文件或其加载逻辑。")
         return {}
 
-    for segment_name, config in segments_config.items():
+    # 请求按6分钟弹幕分段(shard)拆分，所有片段的分段请求共用一个信号量限制并发数后同时进行
+    semaphore = asyncio.Semaphore(DANMAKU_FETCH_CONCURRENCY)
+    # 相邻片段常共享边界处的6分钟分段，按 (cid, 分段索引) 复用同一个请求任务，避免重复下载
+    shard_tasks = {}
+
+    async def fetch_shard(cid, seg_index):
+        """
+        获取单个6分钟分段的弹幕文本列表。
+        拿到原始 Danmaku 对象后立即只保留文本，分段任务被多个片段共用、会保留到全部获取结束，不再一直持有整批弹幕对象。
+        """
+        async with semaphore:
+            # 礼貌性延时在释放信号量前执行以限制请求频率 (命中缓存时不等待)
+            shard_danmakus = await cached_api_call(("danmaku", cid, seg_index),
+                lambda: video_obj.get_danmakus(cid=cid, from_seg=seg_index, to_seg=seg_index),
+                f"获取CID {cid} 第 {seg_index} 段弹幕", delay_range=DANMAKU_REQUEST_DELAY_RANGE)
+        # 从Danmaku对象中提取文本 (get_danmakus 已直接解析 protobuf 分段，无需再经过XML)
+        # 每条弹幕只读取一次 text 属性，避免 hasattr + 重复属性访问
+        return [text for text in (getattr(d, 'text', None) for d in (shard_danmakus or [])) if text and not text.isspace()]
+
+    def get_shard_task(cid, seg_index):
+        key = (cid, seg_index)
+        if key not in shard_tasks:
+            shard_tasks[key] = asyncio.ensure_future(fetch_shard(cid, seg_index))
+        return shard_tasks[key]
+
+    async def fetch_one_segment(segment_name, config):
+        """获取单个片段的弹幕文本列表，失败时返回 None。"""
         print(f"  正在处理片段: {segment_name}")
         page_index = config.get("page_index", 0) # CSV中定义的P号对应的索引 (P1 -> 0, P2 -> 1)
         cid = config.get("cid") # 初始为None，会尝试从pages_info填充
 
         # 如果CSV中没有指定CID，则从视频信息中获取
-        if not cid: 
+        if not cid:
             if pages_info and page_index < len(pages_info):
                 cid = pages_info[page_index]['cid']
                 # print(f"    目标CID: {cid} (对应P{page_index + 1} '{pages_info[page_index]['part']}')")
@@ -504,110 +1397,196 @@ async def fetch_and_save_danmaku(video_obj, segments_config, credential_obj):
                 cid = video_info_data.get('cid') # 直接从顶层获取CID
                 if not cid:
                     print(f"    错误: 无法获取单P视频的CID。跳过片段 {segment_name}。")
-                    continue
+                    return None
                 # print(f"    目标CID: {cid} (单P视频)")
             else:
                 print(f"    错误: 无法确定page_index {page_index}对应的CID (可能是P号超出范围)。跳过片段 {segment_name}。")
-                continue
-        
+                return None
+
         from_seg_index = config.get("from_seg") # 弹幕开始的6分钟段索引
         to_seg_index = config.get("to_seg")     # 弹幕结束的6分钟段索引
 
-        current_segment_danmakus_raw = [] # 存储原始Danmaku对象
         try:
             if from_seg_index is None or to_seg_index is None: # 如果CSV未指定时间范围，则获取该P全部分段
                 # print(f"    警告: 片段 '{segment_name}' 的 from_seg 或 to_seg 未定义，尝试获取CID {cid} 的所有弹幕...")
-                danmaku_view = await video_obj.get_danmaku_view(cid=cid)
+                async with semaphore:
+                    danmaku_view = await cached_api_call(("danmaku_view", cid), lambda: video_obj.get_danmaku_view(cid=cid), f"获取CID {cid} 弹幕概况")
                 total_segments = danmaku_view.get("dm_seg", {}).get("total", 1) # 总共有多少个6分钟段
                 # print(f"    CID {cid} 可用的总6分钟片段数: {total_segments}")
-                if total_segments > 0:
-                    current_segment_danmakus_raw = await video_obj.get_danmakus(cid=cid, from_seg=0, to_seg=max(0, total_segments - 1))
+                seg_indices = range(max(0, total_segments))
             else:
                 # print(f"    正在获取CID {cid} 从6分钟片段 {from_seg_index} 到 {to_seg_index} 的弹幕")
-                current_segment_danmakus_raw = await video_obj.get_danmakus(cid=cid, from_seg=from_seg_index, to_seg=to_seg_index)
-            
+                seg_indices = range(from_seg_index, to_seg_index + 1)
+
+            # gather 按分段顺序返回，拼接后与一次性按区间获取的顺序一致
+            shard_results = await asyncio.gather(*(get_shard_task(cid, seg_index) for seg_index in seg_indices))
         except Exception as e:
             print(f"    获取CID {cid} (片段 '{segment_name}') 的弹幕时出错: {e}")
-            continue # 跳到下一个片段
+            return None
+
+        # 各分段已在 fetch_shard 中提取为文本，直接按分段顺序拼接
+        return list(chain.from_iterable(shard_results))
+
+    # return_exceptions=True: 单个片段出现意外错误时只跳过该片段，不影响其他片段的结果
+    segment_results = await asyncio.gather(
+        *(fetch_one_segment(segment_name, config) for segment_name, config in segments_config.items()),
+        return_exceptions=True
+    )
 
-        # 从Danmaku对象中提取文本
-        segment_danmaku_texts = [d.text for d in current_segment_danmakus_raw if hasattr(d, 'text') and d.text and d.text.strip()]
+    # gather 按提交顺序返回结果，合并后的TXT仍保持CSV中的片段顺序
+    for segment_name, segment_danmaku_texts in zip(segments_config.keys(), segment_results):
+        if isinstance(segment_danmaku_texts, Exception):
+            print(f"    处理片段 '{segment_name}' 时发生意外错误: {segment_danmaku_texts}")
+            continue
+        if segment_danmaku_texts is None: # 获取失败的片段已在上面打印原因
+            continue
         segmented_danmaku_data[segment_name] = segment_danmaku_texts
-        all_danmaku_texts_combined.extend(segment_danmaku_texts)
-        
-        # print(f"    此片段获取到 {len(segment_danmaku_texts)} 条非空弹幕。")
-        await asyncio.sleep(random.uniform(1.0, 2.5)) # 礼貌性延时，避免请求过于频繁
 
-    if not all_danmaku_texts_combined:
+    if not any(segmented_danmaku_data.values()):
         print("未获取到任何弹幕。跳过保存到TXT文件。")
         print("提示：请在B站视频页面上确认目标视频片段确实存在弹幕。")
         return {} # 返回空字典，以便后续判断
 
-    # 保存所有合并的弹幕到TXT文件
+    save_combined_danmaku_txt(segmented_danmaku_data.values()) # 保存所有合并的弹幕到TXT文件
+    return segmented_danmaku_data # 返回包含各片段弹幕的字典
+
+def save_combined_danmaku_txt(segment_texts_iter):
+    """
+    将各片段的弹幕文本按片段顺序逐行写入 DANMAKU_TXT_FILE。
+    逐片段写入，不再先拼接出包含全部弹幕的合并列表；单个片段也按每 10000 行拼接一次，限制临时字符串的大小。
+    """
+    chunk_lines = 10_000
+    total_lines = 0
     try:
-        with open(DANMAKU_TXT_FILE, "w", encoding="utf-8") as f:
-            for text in all_danmaku_texts_combined:
-                f.write(text + "\n")
-        print(f"所有片段的合并弹幕文本 ({len(all_danmaku_texts_combined)} 行) 已保存至 {DANMAKU_TXT_FILE}")
+        with open(DANMAKU_TXT_FILE, "w", encoding="utf-8", buffering=1 << 20) as f:
+            for segment_texts in segment_texts_iter:
+                if not segment_texts:
+                    continue
+                for start in range(0, len(segment_texts), chunk_lines):
+                    f.write("\n".join(segment_texts[start:start + chunk_lines]))
+                    f.write("\n")
+                total_lines += len(segment_texts)
+        print(f"所有片段的合并弹幕文本 ({total_lines} 行) 已保存至 {DANMAKU_TXT_FILE}")
     except Exception as e:
         print(f"保存合并弹幕文件 {DANMAKU_TXT_FILE} 时出错: {e}")
-    
-    return segmented_danmaku_data # 返回包含各片段弹幕的字典
+
+@functools.lru_cache(maxsize=None)
+def load_pil_font(font_path, size):
+    """加载并缓存 PIL 字体，同一进程内多张词云图的标题共用，避免重复解析字体文件。"""
+    return ImageFont.truetype(font_path, size)
+
+def render_wordcloud(word_counts, font_path, out_path, title, width=1000, height=700, max_words=150, title_fontsize=14):
+    """
+    根据词频渲染词云图，并用 PIL 在顶部加上标题后直接保存 (不经过 matplotlib 的 figure/savefig)。
+    模块级函数，可在子进程中执行；成功返回 None，出错返回错误信息。
+    """
+    try:
+        from wordcloud import WordCloud # 首次渲染时才导入 (子进程中各自导入一次)
+        wc = WordCloud(
+            font_path=font_path, width=width, height=height, background_color="white",
+            max_words=max_words, collocations=False # 避免词语组合
+        ).generate_from_frequencies(word_counts)
+        if not title:
+            wc.to_file(out_path)
+            return None
+
+        title_font = load_pil_font(font_path, title_fontsize * 2) # 按像素计的标题字号
+        title_height = title_fontsize * 4
+        image = Image.new("RGB", (width, height + title_height), "white")
+        image.paste(wc.to_image(), (0, title_height))
+        draw = ImageDraw.Draw(image)
+        text_width = draw.textlength(title, font=title_font)
+        draw.text(((width - text_width) / 2, title_height / 2), title, font=title_font, fill="black", anchor="lm")
+        image.save(out_path)
+    except Exception as e:
+        return str(e)
+    return None
+
+def render_wordclouds(wordcloud_jobs):
+    """渲染多张词云图：任务多于一个时分发到进程池并行渲染，失败时回退为逐个渲染。"""
+    if not wordcloud_jobs:
+        return
+    errors = None
+    if WORDCLOUD_WORKERS > 1 and len(wordcloud_jobs) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(WORDCLOUD_WORKERS, len(wordcloud_jobs))) as executor:
+                futures = [executor.submit(render_wordcloud, **job_kwargs) for _, job_kwargs in wordcloud_jobs]
+                errors = [future.result() for future in futures]
+        except Exception as e: # 例如子进程异常退出 (BrokenProcessPool)
+            print(f"    并行渲染词云图失败 ({e})，改为逐个渲染。")
+            errors = None
+    if errors is None:
+        errors = [render_wordcloud(**job_kwargs) for _, job_kwargs in wordcloud_jobs]
+
+    for (segment_name, _), error in zip(wordcloud_jobs, errors):
+        if error:
+            print(f"    为片段 '{segment_name}' 生成词云图时出错: {error}")
+        # else:
+            # print(f"    片段 '{segment_name}' 的词云图已保存")
 
 def analyze_danmaku_and_generate_wordclouds(segmented_danmaku_data, all_sentiment_word_data_for_excel):
     """
     对分段的弹幕数据进行词频分析、词云图生成，并提取情感高频词。
     (此函数主要用于生成各片段的词云图和Excel中的分段情感词)
+    返回 (所有片段词频之和, 各情感类别的词频之和)，供总弹幕分析直接使用，无需再读回合并TXT重新分词。
     """
     if not segmented_danmaku_data:
         print("没有分段弹幕数据可供分析。")
-        return
+        return None, None
 
-    custom_filter_for_wordcloud = ["贺电", "发来贺电", "恭喜"] # 词云图中希望过滤的词
+    custom_filter_for_wordcloud = WORDCLOUD_FILTER_WORDS
     all_frequency_data_for_report = [] # 用于CSV报告
+    overall_word_counts = Counter() # 各片段词频 (未过滤) 累加，即合并弹幕的总词频；过滤词在最后对总词表统一剔除一次
+    overall_sentiment_word_counts = {'positive': Counter(), 'neutral': Counter(), 'negative': Counter()} # 同理，按情感类别累加
+    wordcloud_jobs = [] # (片段名称, render_wordcloud 参数)
 
     print("\n--- 开始为每个片段生成词云图、词频统计和情感词频提取 (用于Excel) ---")
+    # 先把所有片段的弹幕 (去重后) 整批分词、打分：单个片段往往达不到并行分词/打分的文本数门槛，
+    # 合在一起后才能用上多进程；之后逐片段的处理直接命中缓存。超出分词缓存上限时不预热，避免缓存被中途清空。
+    all_unique_texts = list(dict.fromkeys(
+        text for danmaku_texts in segmented_danmaku_data.values() if danmaku_texts
+        for text in danmaku_texts if text and text.strip()
+    ))
+    if len(all_unique_texts) <= PREPROCESS_CACHE_SIZE:
+        segment_texts_cached(all_unique_texts)
+        score_texts(all_unique_texts)
+
     for segment_name, danmaku_texts_for_segment in segmented_danmaku_data.items():
         # print(f"\n  正在分析片段: {segment_name}")
         if not danmaku_texts_for_segment:
             # print(f"    片段 '{segment_name}' 没有弹幕文本，跳过分析。")
             continue
 
+        # 片段内的弹幕只做一遍预处理 (不带过滤词)，同一份分词结果同时用于词云词频和下面各情感类别的高频词
+        valid_texts = [text for text in danmaku_texts_for_segment if text and text.strip()]
+        token_lists = preprocess_texts(valid_texts)
+        segment_word_counts = count_tokens(token_lists)
+
         # 1. 常规词频与词云图 (与原逻辑类似)
-        processed_words_segment_for_wc = []
-        for text in danmaku_texts_for_segment:
-            processed_words_segment_for_wc.extend(preprocess_text(text, custom_filter_words=custom_filter_for_wordcloud))
+        # 词云过滤词在统计后按不同词逐个剔除，而不是对每个词元都判断一次
+        overall_word_counts.update(segment_word_counts)
+        word_counts_segment = drop_filtered_words(segment_word_counts, custom_filter_for_wordcloud)
         
-        if processed_words_segment_for_wc:
-            word_counts_segment = Counter(processed_words_segment_for_wc)
+        if word_counts_segment:
             total_words_in_segment = sum(word_counts_segment.values())
             
             # print(f"    片段 '{segment_name}' (词云用) 词频最高的前20个词:")
-            for rank, (word, count) in enumerate(word_counts_segment.most_common(20), 1):
+            for rank, (word, count) in enumerate(top_n_from_counter(word_counts_segment, 20), 1):
                 percentage = (count / total_words_in_segment) * 100 if total_words_in_segment > 0 else 0
                 all_frequency_data_for_report.append({
                     "片段名称": segment_name, "排名": rank, "关键词": word,
                     "词频数量": count, "词频百分比(%)": f"{percentage:.2f}" 
                 })
 
-            font_prop_wc = FontProperties(fname=FONT_PATH) if FONT_PATH and os.path.exists(FONT_PATH) else None
-            if font_prop_wc:
-                safe_segment_name = re.sub(r'[\\/*?:"<>|]', "_", segment_name) # 文件名安全处理
+            if FONT_PATH and os.path.exists(FONT_PATH):
+                safe_segment_name = segment_name.translate(_FILENAME_SAFE_TABLE) # 文件名安全处理
                 segment_wordcloud_filename = os.path.join(OUTPUT_DIR, f"wordcloud_segment_{safe_segment_name}.png")
-                try:
-                    wc_segment = WordCloud(
-                        font_path=FONT_PATH, width=1000, height=700, background_color="white",
-                        max_words=150, collocations=False # 避免词语组合
-                    ).generate_from_frequencies(word_counts_segment)
-                    plt.figure(figsize=(10, 7))
-                    plt.imshow(wc_segment, interpolation="bilinear")
-                    plt.axis("off")
-                    plt.title(f"弹幕词云图 - 片段: {segment_name}", fontproperties=font_prop_wc, fontsize=14)
-                    plt.savefig(segment_wordcloud_filename)
-                    # print(f"    片段 '{segment_name}' 的词云图已保存至 {segment_wordcloud_filename}")
-                    plt.close() 
-                except Exception as e:
-                    print(f"    为片段 '{segment_name}' 生成词云图时出错: {e}")
+                # 渲染较耗CPU，先收集任务，所有片段统计完成后再并行渲染
+                wordcloud_jobs.append((segment_name, dict(
+                    word_counts=word_counts_segment, font_path=FONT_PATH, out_path=segment_wordcloud_filename,
+                    title=f"弹幕词云图 - 片段: {segment_name}",
+                    max_words=min(150, len(word_counts_segment)) # 词汇稀少时减少布局尝试
+                )))
             # else:
                 # print(f"    警告: 字体路径 '{FONT_PATH}' 未找到或无效。无法为片段 '{segment_name}' 生成词云图。")
         # else:
@@ -615,20 +1594,22 @@ def analyze_danmaku_and_generate_wordclouds(segmented_danmaku_data, all_sentimen
 
         # 2. 提取情感高频词 (用于Excel)
         # print(f"    正在为片段 '{segment_name}' 提取情感高频词 (Excel用)...")
-        categorized_segment_danmaku = classify_texts_by_sentiment(danmaku_texts_for_segment)
-        for sentiment_key, sentiment_texts in categorized_segment_danmaku.items():
-            if sentiment_texts:
-                top_words = get_top_n_words(sentiment_texts, TOP_N_SENTIMENT_WORDS) # 使用配置的TOP_N
+        # 按情感掩码直接选取对应文本的分词结果统计，不再对各类别文本重新预处理
+        positive_mask, neutral_mask, negative_mask = sentiment_masks(score_texts(valid_texts))
+        for sentiment_key, mask in (('positive', positive_mask), ('neutral', neutral_mask), ('negative', negative_mask)):
+            if mask.any():
+                sentiment_word_counts = count_tokens(compress(token_lists, mask))
+                overall_sentiment_word_counts[sentiment_key].update(sentiment_word_counts)
+                top_words = top_n_from_counter(sentiment_word_counts, TOP_N_SENTIMENT_WORDS) # 使用配置的TOP_N
                 if top_words:
-                    # print(f"      片段 '{segment_name}' - {sentiment_label_chinese_map[sentiment_key]} ({len(sentiment_texts)}条) 高频词 (Excel用):")
+                    # print(f"      片段 '{segment_name}' - {sentiment_label_chinese_map[sentiment_key]} ({int(mask.sum())}条) 高频词 (Excel用):")
                     for word, freq in top_words:
                         # print(f"        {word}: {freq}") # 可选打印
-                        all_sentiment_word_data_for_excel.append({
-                            'Type': '弹幕', 'Scope': f'片段: {segment_name}',
-                            'Sentiment': sentiment_label_chinese_map[sentiment_key],
-                            'Word': word, 'Frequency': freq
-                        })
+                        all_sentiment_word_data_for_excel.append(
+                            ('弹幕', f'片段: {segment_name}', sentiment_label_chinese_map[sentiment_key], word, freq))
     
+    render_wordclouds(wordcloud_jobs)
+
     if all_frequency_data_for_report:
         try:
             freq_df = pd.DataFrame(all_frequency_data_for_report)
@@ -636,58 +1617,55 @@ def analyze_danmaku_and_generate_wordclouds(segmented_danmaku_data, all_sentimen
             print(f"\n分段弹幕词频报告 (词云图用数据) 已保存至: {SEGMENTED_FREQUENCY_REPORT_CSV}")
         except Exception as e:
             print(f"保存分段词频报告时出错: {e}")
+    return drop_filtered_words(overall_word_counts, custom_filter_for_wordcloud), overall_sentiment_word_counts
 
 
-def analyze_overall_danmaku_from_txt(txt_filepath, wordcloud_filepath, all_sentiment_word_data_for_excel):
+def analyze_overall_danmaku_from_txt(txt_filepath, wordcloud_filepath, all_sentiment_word_data_for_excel,
+                                     precomputed_word_counts=None, precomputed_sentiment_word_counts=None):
     """
     从合并的弹幕TXT文件进行总的词频分析、词云图生成，并提取情感高频词 (用于Excel)。
+    precomputed_word_counts: 各片段词频之和 (来自 analyze_danmaku_and_generate_wordclouds)，提供时直接用于词云图。
+    precomputed_sentiment_word_counts: 各情感类别的片段词频之和；与 precomputed_word_counts 都提供时不再读回TXT。
     """
     print(f"\n--- 开始基于 {txt_filepath} 的总弹幕分析 (词云图与Excel情感词) ---")
-    if not os.path.exists(txt_filepath):
-        print(f"错误: 合并弹幕文件 {txt_filepath} 未找到。跳过总弹幕分析。")
-        return
+    all_danmaku_text_lines = None
+    if precomputed_word_counts is None or precomputed_sentiment_word_counts is None:
+        if not os.path.exists(txt_filepath):
+            print(f"错误: 合并弹幕文件 {txt_filepath} 未找到。跳过总弹幕分析。")
+            return
 
-    try:
-        with open(txt_filepath, "r", encoding="utf-8") as f:
-            all_danmaku_text_lines = [line.strip() for line in f.readlines() if line.strip()]
-    except Exception as e:
-        print(f"读取合并弹幕文件 {txt_filepath} 时出错: {e}")
-        return
-        
-    if not all_danmaku_text_lines:
-        print("合并弹幕文件为空，跳过总弹幕分析。")
-        return
+        try:
+            with open(txt_filepath, "r", encoding="utf-8") as f:
+                all_danmaku_text_lines = [line.strip() for line in f.readlines() if line.strip()]
+        except Exception as e:
+            print(f"读取合并弹幕文件 {txt_filepath} 时出错: {e}")
+            return
+
+        if not all_danmaku_text_lines:
+            print("合并弹幕文件为空，跳过总弹幕分析。")
+            return
 
     # 1. 常规词频与词云图 (与原逻辑类似)
-    filter_words_for_overall_wc = ["贺电", "发来贺电", "恭喜", "大学发来贺电", "学院发来贺电", "职业技术学院发来贺电", "科技大学发来贺电"]
+    filter_words_for_overall_wc = OVERALL_WORDCLOUD_FILTER_WORDS
     
-    processed_words_for_cloud_display = []
-    for text_line in all_danmaku_text_lines:
-        processed_words_for_cloud_display.extend(preprocess_text(text_line, custom_filter_words=filter_words_for_overall_wc))
+    if precomputed_word_counts is not None:
+        # 片段过滤词 "贺电"/"恭喜" 按子串匹配，已覆盖这里所有更长的 "...发来贺电" 过滤词，两者过滤结果一致
+        word_counts_for_cloud_display = precomputed_word_counts
+    else:
+        word_counts_for_cloud_display = count_tokens(preprocess_texts(all_danmaku_text_lines, custom_filter_words=filter_words_for_overall_wc))
     
-    if processed_words_for_cloud_display:
-        word_counts_for_cloud_display = Counter(processed_words_for_cloud_display)
+    if word_counts_for_cloud_display:
         # print("\n总弹幕 (词云用) 词频最高的30个词 (已过滤“贺电”类):")
         # for word, count in word_counts_for_cloud_display.most_common(30):
             # print(f"  {word}: {count}") # 可选打印
 
-        font_prop_wc_overall = FontProperties(fname=FONT_PATH) if FONT_PATH and os.path.exists(FONT_PATH) else None
-        if font_prop_wc_overall:
-            try:
-                wc_overall = WordCloud(
-                    font_path=FONT_PATH, width=1200, height=800, background_color="white",
-                    max_words=200, collocations=False 
-                ).generate_from_frequencies(word_counts_for_cloud_display) 
-
-                plt.figure(figsize=(12, 9))
-                plt.imshow(wc_overall, interpolation="bilinear")
-                plt.axis("off")
-                plt.title("总弹幕词云图 (基于TXT, 已过滤)", fontproperties=font_prop_wc_overall, fontsize=16)
-                plt.savefig(wordcloud_filepath) 
+        if FONT_PATH and os.path.exists(FONT_PATH):
+            error = render_wordcloud(word_counts_for_cloud_display, FONT_PATH, wordcloud_filepath, "总弹幕词云图 (基于TXT, 已过滤)",
+                                     width=1200, height=800, max_words=200, title_fontsize=16)
+            if error:
+                print(f"生成总弹幕词云图时出错: {error}")
+            else:
                 print(f"总弹幕词云图已保存至 {wordcloud_filepath}")
-                plt.close() 
-            except Exception as e:
-                print(f"生成总弹幕词云图时出错: {e}")
         # else:
             # print(f"错误: 字体路径 '{FONT_PATH}' 未找到或无效。无法生成总词云图。")
     # else:
@@ -695,94 +1673,249 @@ def analyze_overall_danmaku_from_txt(txt_filepath, wordcloud_filepath, all_senti
 
     # 2. 提取情感高频词 (用于Excel)
     # print(f"\n  正在为总弹幕 (来自 {txt_filepath}) 提取情感高频词 (Excel用)...")
-    categorized_overall_danmaku = classify_texts_by_sentiment(all_danmaku_text_lines)
-    for sentiment_key, sentiment_texts in categorized_overall_danmaku.items():
-        if sentiment_texts:
-            top_words = get_top_n_words(sentiment_texts, TOP_N_SENTIMENT_WORDS) # 使用配置的TOP_N
-            if top_words:
-                # print(f"    总弹幕 - {sentiment_label_chinese_map[sentiment_key]} ({len(sentiment_texts)}条) 高频词 (Excel用):")
-                for word, freq in top_words:
-                    # print(f"      {word}: {freq}") # 可选打印
-                    all_sentiment_word_data_for_excel.append({
-                        'Type': '弹幕', 'Scope': '整体 (来自TXT)',
-                        'Sentiment': sentiment_label_chinese_map[sentiment_key],
-                        'Word': word, 'Frequency': freq
-                    })
+    if precomputed_sentiment_word_counts is not None:
+        overall_top_words = {sentiment_key: top_n_from_counter(word_counts, TOP_N_SENTIMENT_WORDS) # 使用配置的TOP_N
+                             for sentiment_key, word_counts in precomputed_sentiment_word_counts.items()}
+    else:
+        categorized_overall_danmaku = classify_texts_by_sentiment(all_danmaku_text_lines)
+        overall_top_words = {sentiment_key: get_top_n_words(sentiment_texts, TOP_N_SENTIMENT_WORDS) if sentiment_texts else []
+                             for sentiment_key, sentiment_texts in categorized_overall_danmaku.items()}
+    for sentiment_key, top_words in overall_top_words.items():
+        # print(f"    总弹幕 - {sentiment_label_chinese_map[sentiment_key]} 高频词 (Excel用):")
+        for word, freq in top_words:
+            # print(f"      {word}: {freq}") # 可选打印
+            all_sentiment_word_data_for_excel.append(
+                ('弹幕', '整体 (来自TXT)', sentiment_label_chinese_map[sentiment_key], word, freq))
 
 
 # --- 评论处理 ---
+def iter_replies(replies):
+    """依次产出每条顶级评论及其一级子评论 ('replies' 键下的子评论列表)，跳过空项。"""
+    for reply in replies:
+        if not reply:
+            continue
+        yield reply
+        sub_replies = reply.get('replies')
+        if sub_replies:
+            yield from filter(None, sub_replies)
+
+
 async def fetch_comments(video_obj, credential_obj):
-    """获取视频的所有评论文本。"""
+    """获取视频的所有评论文本，返回 (评论文本列表, 是否完整)；有评论页请求出错时视为不完整。"""
     print("\n正在获取评论...")
-    all_comments_data = [] # 存储评论文本和ID，用于去重
-    current_page_num = 1 
+    all_comment_texts = [] # 按获取顺序存储不重复的评论文本
     fetched_comment_ids = set() # 用于跟踪已获取的评论ID，避免重复
 
     if not video_obj.aid: # 确保有AID才能获取评论
         print("错误: 视频对象缺少有效的AID (video_obj.aid)，无法获取评论。")
-        return []
+        return [], False
+
+    def collect_replies(replies):
+        """收集顶级评论及其一级子评论中未见过的评论，返回新增条数。"""
+        # 先用推导式整页提取 {rpid: 评论文本} (顶级评论与子评论单趟遍历)，再整体与已获取的ID比较，批量追加并更新集合
+        page_messages = {
+            rpid: message for reply in iter_replies(replies)
+            if (rpid := reply.get('rpid')) and (message := (reply.get('content') or {}).get('message'))
+        }
+        new_messages = {rpid: message for rpid, message in page_messages.items() if rpid not in fetched_comment_ids}
+        all_comment_texts.extend(new_messages.values())
+        fetched_comment_ids.update(new_messages)
+        return len(new_messages)
+
+    if COMMENT_FETCH_MODE == "cursor":
+        if hasattr(comment, "get_comments_lazy"):
+            complete = await fetch_comments_by_cursor(video_obj, credential_obj, collect_replies)
+            print(f"总共获取到 {len(all_comment_texts)} 条不重复的评论文本。")
+            return all_comment_texts, complete
+        print("警告: 当前 bilibili_api 版本不提供 comment.get_comments_lazy，回退为按页码获取评论。")
+
+    async def fetch_page(page_num, delay_range=None):
+        # 使用 bilibili_api 的 comment.get_comments 方法
+        # 修正：直接使用 CommentResourceType.VIDEO (假设它本身是整数)
+        # 评论会持续增加，页码与内容随之移动，不走 cached_api_call 的磁盘缓存 (完整结果由数据快照复用)
+        comments_page = await call_with_retry(lambda: comment.get_comments(
+            video_obj.aid,                       # Positional OID
+            CommentResourceType.VIDEO,           # Positional type (直接使用枚举成员)
+            page_num,                            # Positional page number
+            credential=credential_obj            # Keyword credential
+        ), f"获取评论第 {page_num} 页")
+        if delay_range:
+            await asyncio.sleep(random.uniform(*delay_range))
+        return comments_page
+
+    def handle_page(page_num, comments_page):
+        """处理一页结果 (或请求异常)，返回该页新增的评论条数；出错或该页为空时返回 None。"""
+        if isinstance(comments_page, TypeError):
+            print(f"  获取评论第 {page_num} 页时发生类型错误: {comments_page}")
+            print(f"  这可能是由于 bilibili_api 版本与预期参数不符。请检查API用法或库版本。")
+            return None
+        if isinstance(comments_page, Exception):
+            print(f"  获取评论第 {page_num} 页时出错: {comments_page}")
+            return None
+
+        if not comments_page or not comments_page.get('replies'):
+            # print(f"  在第 {page_num} 页未找到更多评论，或已到达评论末尾。")
+            return None # 没有更多评论或API返回空
 
+        # print(f"  已获取第 {page_num} 页评论 (包含 {len(comments_page['replies'])} 条顶级回复)")
+        return collect_replies(comments_page['replies'])
+
+    def reached_end(comments_page):
+        """逐页获取时的翻页判断：API 明确告知已到末尾，或已获取数量达到API报告的总数。"""
+        cursor_info = comments_page.get('cursor', {})
+        if cursor_info.get('is_end', False):
+             # print("  API返回已到达评论末尾 (is_end is True)。")
+             return True
+        return cursor_info.get('all_count', 0) > 0 and len(fetched_comment_ids) >= cursor_info.get('all_count', 0)
+
+    # 先请求第1页，从返回的总数推算总页数
+    try:
+        first_page = await fetch_page(1)
+    except Exception as e:
+        handle_page(1, e) # 打印出错原因
+        print(f"总共获取到 {len(all_comment_texts)} 条不重复的评论文本。")
+        return all_comment_texts, False
+    if handle_page(1, first_page) is None or reached_end(first_page):
+        print(f"总共获取到 {len(all_comment_texts)} 条不重复的评论文本。")
+        return all_comment_texts, True
+
+    # 优先使用 page.count (顶级评论数)；没有时退而使用 cursor.all_count (含子评论，会略多估页数，多出的页为空页)
+    page_info = first_page.get('page') or {}
+    total_count = page_info.get('count') or first_page.get('cursor', {}).get('all_count', 0)
+    page_size = page_info.get('size') or len(first_page['replies'])
+    total_pages = math.ceil(total_count / page_size) if total_count and page_size else 0
+    complete = True
+
+    if total_pages > 1:
+        # 已知总页数：其余各页在信号量限制下同时请求，再按页码顺序合并。
+        # 个别页出错或为空 (如按 all_count 多估的末尾空页) 时只跳过该页，其余页照常合并
+        semaphore = asyncio.Semaphore(COMMENT_FETCH_CONCURRENCY)
+
+        async def fetch_page_paced(page_num):
+            async with semaphore:
+                return await fetch_page(page_num, delay_range=(0.2, 0.5)) # 带抖动的礼貌性延时，避免触发风控
+
+        remaining_page_nums = range(2, total_pages + 1)
+        page_results = await asyncio.gather(*(fetch_page_paced(p) for p in remaining_page_nums), return_exceptions=True)
+        skipped_page_nums = [page_num for page_num, comments_page in zip(remaining_page_nums, page_results)
+                             if handle_page(page_num, comments_page) is None]
+        if skipped_page_nums:
+            print(f"  评论第 {', '.join(map(str, skipped_page_nums))} 页出错或为空，已跳过。")
+        complete = not any(isinstance(comments_page, Exception) for comments_page in page_results)
+    elif total_count == 0:
+        # 接口未返回总数时，回退为逐批预取：每批并发预取 COMMENT_PREFETCH_BATCH 页，
+        # 按页码顺序合并，直到 API 报告已到末尾 (或某页出错/为空，无法继续确定后续页)
+        current_page_num = 2
+        finished = False
+        while not finished:
+            await asyncio.sleep(random.uniform(1.5, 3.0)) # 每批之间的礼貌性延时
+            batch_page_nums = list(range(current_page_num, current_page_num + COMMENT_PREFETCH_BATCH))
+            batch_results = await asyncio.gather(*(fetch_page(p) for p in batch_page_nums), return_exceptions=True)
+            for page_num, comments_page in zip(batch_page_nums, batch_results):
+                if handle_page(page_num, comments_page) is None or reached_end(comments_page):
+                    complete = not isinstance(comments_page, Exception)
+                    finished = True
+                    break
+            current_page_num += COMMENT_PREFETCH_BATCH
+
+    print(f"总共获取到 {len(all_comment_texts)} 条不重复的评论文本。")
+    return all_comment_texts, complete
+
+async def fetch_comments_by_cursor(video_obj, credential_obj, collect_replies):
+    """
+    使用 next_offset 游标逐页获取评论 (comment.get_comments_lazy)。
+    游标接口每页由服务端决定条数，无需反复估算页码；每页结果交给 collect_replies 去重收集。
+    正常翻到末尾时返回 True，请求出错中断时返回 False。
+    """
+    offset = ""
     while True:
         try:
-            # print(f"  尝试获取评论第 {current_page_num} 页...") # 用于调试
-            # 使用 bilibili_api 的 comment.get_comments 方法
-            # 修正：直接使用 CommentResourceType.VIDEO (假设它本身是整数)
-            comments_page = await comment.get_comments(
-                video_obj.aid,                       # Positional OID
-                CommentResourceType.VIDEO,           # Positional type (直接使用枚举成员)
-                current_page_num,                    # Positional page number
-                credential=credential_obj            # Keyword credential
-            )
-            
-            if not comments_page or not comments_page.get('replies'):
-                # print(f"  在第 {current_page_num} 页未找到更多评论，或已到达评论末尾。")
-                break # 没有更多评论或API返回空
-            
-            current_page_replies = comments_page['replies']
-            # print(f"  已获取第 {current_page_num} 页评论 (包含 {len(current_page_replies)} 条顶级回复)")
-
-            new_comments_on_page = 0
-            for reply in current_page_replies: # 遍历顶级评论
-                if reply and reply.get('rpid') and reply['rpid'] not in fetched_comment_ids and \
-                   reply.get('content') and reply['content'].get('message'):
-                    all_comments_data.append({'text': reply['content']['message'], 'id': reply['rpid']})
-                    fetched_comment_ids.add(reply['rpid'])
-                    new_comments_on_page +=1
-                
-                # 检查并获取子评论 (通常只获取一级子评论)
-                if reply and reply.get('replies'): # 'replies' 键下是子评论列表
-                    for sub_reply in reply['replies']:
-                        if sub_reply and sub_reply.get('rpid') and sub_reply['rpid'] not in fetched_comment_ids and \
-                           sub_reply.get('content') and sub_reply['content'].get('message'):
-                            all_comments_data.append({'text': sub_reply['content']['message'], 'id': sub_reply['rpid']})
-                            fetched_comment_ids.add(sub_reply['rpid'])
-                            new_comments_on_page += 1
-            
-            # 翻页逻辑
-            current_page_num += 1 
-            cursor_info = comments_page.get('cursor', {})
-            if cursor_info.get('is_end', False): # API明确告知已到末尾
-                 # print("  API返回已到达评论末尾 (is_end is True)。")
-                 break
-            if cursor_info.get('all_count', 0) > 0 and len(fetched_comment_ids) >= cursor_info.get('all_count', 0):
-                 # print("  已获取评论数量达到API报告的总数。")
-                 break
-            if new_comments_on_page == 0 and current_page_num > 2: 
-                # print(f"  在第 {current_page_num-1} 页未获取到新评论，可能已到末尾。")
-                break
+            comments_page = await call_with_retry(lambda: comment.get_comments_lazy(
+                video_obj.aid, CommentResourceType.VIDEO, offset=offset, credential=credential_obj
+            ), f"获取评论 (游标 {offset or '起始'})")
+        except Exception as e:
+            print(f"  通过游标获取评论时出错: {e}")
+            return False
 
+        if not comments_page or not comments_page.get('replies'):
+            break # 没有更多评论或API返回空
+        new_comments_on_page = collect_replies(comments_page['replies'])
 
-            await asyncio.sleep(random.uniform(1.5, 3.0)) # 礼貌性延时
-        except TypeError as te: 
-            print(f"  获取评论第 {current_page_num} 页时发生类型错误: {te}")
-            print(f"  这可能是由于 bilibili_api 版本与预期参数不符。请检查API用法或库版本。")
-            break 
-        except Exception as e:
-            print(f"  获取评论第 {current_page_num} 页时出错: {e}")
-            break 
+        cursor_info = comments_page.get('cursor', {})
+        next_offset = cursor_info.get('pagination_reply', {}).get('next_offset')
+        if cursor_info.get('is_end', False) or not next_offset or next_offset == offset or new_comments_on_page == 0:
+            break
+        offset = next_offset
+        await asyncio.sleep(random.uniform(0.5, 1.5)) # 游标翻页只能顺序进行，每页之间的礼貌性延时
+    return True
+
+_category_tokenizers = {} # 类别关键词元组 -> 加入了这些关键词的独立 jieba 分词器
+
+def get_category_tokenizer(keywords):
+    """
+    返回加入了类别关键词的独立 jieba.Tokenizer (按关键词组合缓存)，保证多字关键词 (如 "文化自信") 被切分为一个完整的词。
+    不修改全局默认分词器 jieba.dt，词云、情感词等其他分析的分词结果及其缓存不受影响。
+    """
+    tokenizer = _category_tokenizers.get(keywords)
+    if tokenizer is None:
+        wait_for_jieba()
+        tokenizer = jieba.Tokenizer()
+        tokenizer.cache_file = jieba.dt.cache_file # 与默认分词器共用前缀词典缓存
+        if os.path.exists(JIEBA_USER_DICT_FILE):
+            try:
+                tokenizer.load_userdict(JIEBA_USER_DICT_FILE)
+            except Exception as e:
+                print(f"警告: 加载jieba用户词典 {JIEBA_USER_DICT_FILE} 失败: {e}")
+        for keyword in keywords:
+            tokenizer.add_word(keyword)
+        _category_tokenizers[keywords] = tokenizer
+    return tokenizer
 
-    print(f"总共获取到 {len(all_comments_data)} 条不重复的评论文本。")
-    return [item['text'] for item in all_comments_data] 
+def keyword_category_membership(texts_lower, categories_keywords):
+    """
+    计算文本与关键词类别的归属矩阵 (N条文本 × C个类别 的布尔数组，列顺序与 categories_keywords 一致)。
+    texts_lower 需已小写；一条文本可同时属于多个类别。
+    CATEGORY_MATCH_BY_TOKENS 为 True 时，每条文本分词一次，逐词查 关键词->类别 的反向索引；
+    否则为子串匹配：安装了 pyahocorasick 时，用全部类别的关键词构建一个自动机，每条文本只扫描一遍即得到其所属的所有类别，
+    未安装时将每个类别的关键词编译为一个交替正则，以一次 search 代替逐个关键词的子串判断。
+    """
+    keywords_by_category = [[k.lower() for k in keywords if k] for keywords in categories_keywords.values()]
+    membership = np.zeros((len(texts_lower), len(keywords_by_category)), dtype=bool)
+
+    # 关键词 -> 所属类别索引 的反向索引，命中一个关键词即可直接定位其所有类别，无需再逐个类别判断
+    category_indices_by_keyword = {}
+    for category_index, keywords in enumerate(keywords_by_category):
+        for keyword in keywords:
+            category_indices_by_keyword.setdefault(keyword, set()).add(category_index)
+    category_indices_by_keyword = {keyword: tuple(indices) for keyword, indices in category_indices_by_keyword.items()}
+    if not category_indices_by_keyword:
+        return membership
+
+    if CATEGORY_MATCH_BY_TOKENS:
+        tokenizer = get_category_tokenizer(tuple(category_indices_by_keyword))
+        for text_index, text_lower in enumerate(texts_lower):
+            for token in set(tokenizer.lcut(text_lower, HMM=JIEBA_USE_HMM)):
+                category_indices = category_indices_by_keyword.get(token)
+                if category_indices:
+                    membership[text_index, category_indices] = True
+        return membership
+
+    if AHOCORASICK_AVAILABLE:
+        automaton = ahocorasick.Automaton()
+        for keyword, category_indices in category_indices_by_keyword.items():
+            automaton.add_word(keyword, category_indices)
+        automaton.make_automaton()
+        for text_index, text_lower in enumerate(texts_lower):
+            for _, category_indices in automaton.iter(text_lower):
+                membership[text_index, category_indices] = True
+        return membership
+
+    for category_index, keywords in enumerate(keywords_by_category):
+        if not keywords:
+            continue
+        keyword_search = get_custom_filter_regex(tuple(keywords)).search # 同样是“包含任一词”的子串匹配
+        membership[:, category_index] = [bool(keyword_search(text_lower)) for text_lower in texts_lower]
+    return membership
 
 def analyze_comment_sentiment(comment_texts, sentiment_categories_keywords, all_sentiment_word_data_for_excel):
     """
@@ -792,7 +1925,11 @@ def analyze_comment_sentiment(comment_texts, sentiment_categories_keywords, all_
         print("没有评论文本可供情感分析。")
         return
 
+    font_prop = get_chart_font() # 字体只在进程内首次绘图前解析/探测一次，之后直接复用
+    from matplotlib.figure import Figure # 不经过 pyplot 全局状态直接创建图像，可在线程中绘制 (在主线程中导入，绘图线程直接使用)
+
     # --- 辅助函数：绘制饼图 (确保中文显示) ---
+    # 直接创建 Figure 而不经过 pyplot 的全局状态，可安全地在线程池中绘制和保存，与后续的情感打分/词频统计重叠进行
     def plot_pie_chart(data_dict, chart_title, filename):
         sentiment_labels_cn_map = {
             'positive': '正面', 'neutral': '中性', 'negative': '负面'
@@ -810,114 +1947,79 @@ def analyze_comment_sentiment(comment_texts, sentiment_categories_keywords, all_
             
         colors = ['#66b3ff','#99ff99', '#ffcc99', '#ff9999', '#c2c2f0','#ffb3e6'] 
         
-        plt.figure(figsize=(10, 8))
-        
-        font_prop = None
-        if FONT_PATH and os.path.exists(FONT_PATH):
-            try:
-                font_prop = FontProperties(fname=FONT_PATH)
-                if font_prop.get_name() not in plt.rcParams['font.sans-serif']:
-                    plt.rcParams['font.sans-serif'].insert(0, font_prop.get_name())
-            except Exception as e_font_load:
-                # print(f"警告: 加载 FONT_PATH ('{FONT_PATH}') 失败: {e_font_load}。尝试备选字体。")
-                font_prop = None
-
-        if not font_prop: # 如果指定字体加载失败，尝试系统默认中文字体
-            default_chinese_fonts = ['PingFang SC','Songti SC','STHeiti','SimHei', 'Microsoft YaHei', 'WenQuanYi Micro Hei', 'Noto Sans CJK SC']
-            for font_name_try in default_chinese_fonts:
-                try:
-                    test_prop = FontProperties(family=font_name_try) # 尝试使用字体名
-                    plt.rcParams['font.sans-serif'].insert(0, test_prop.get_name())
-                    font_prop = test_prop 
-                    # print(f"信息: 饼图使用备选系统字体: {test_prop.get_name()}")
-                    break 
-                except Exception: # 如果字体名无效或不存在，会出错
-                    # Attempt to remove if added, to prevent issues with invalid font names in rcParams
-                    try:
-                        if test_prop.get_name() in plt.rcParams['font.sans-serif']: 
-                            plt.rcParams['font.sans-serif'].remove(test_prop.get_name())
-                    except Exception:
-                        pass # Ignore if removal fails or test_prop name is problematic
-                    continue
-            # if not font_prop:
-                 # print(f"警告：未能自动找到可用的中文字体。饼图中的中文可能无法正确显示。")
-
-        plt.rcParams['axes.unicode_minus'] = False # 正确显示负号
+        fig = Figure(figsize=(10, 8))
+        ax = fig.subplots()
 
-        wedges, texts, autotexts = plt.pie(active_sizes, labels=active_labels, autopct='%1.1f%%', 
+        wedges, texts, autotexts = ax.pie(active_sizes, labels=active_labels, autopct='%1.1f%%', 
                                            startangle=140, colors=colors[:len(active_sizes)], 
                                            pctdistance=0.85) # 百分比显示在饼图内部
         if font_prop: # 如果成功获取字体属性，应用到文本上
             for text_obj in texts + autotexts:
                 text_obj.set_fontproperties(font_prop)
         
-        plt.title(chart_title, fontproperties=font_prop, fontsize=16) 
-        plt.axis('equal') # 保证饼图是圆形
-        plt.tight_layout() # 调整布局以防止标签重叠
+        ax.set_title(chart_title, fontproperties=font_prop, fontsize=16) 
+        ax.axis('equal') # 保证饼图是圆形
+        fig.tight_layout() # 调整布局以防止标签重叠
         try:
-            plt.savefig(filename)
+            fig.savefig(filename)
             print(f"饼图已保存至 {filename}")
         except Exception as e:
             print(f"保存饼图 {filename} 时出错: {e}")
-        plt.close() # 关闭图像，释放资源
 
-    # 1. 总体情感分析 (饼图用) 和 总体情感高频词提取 (Excel用)
-    print("\n--- 开始总体评论情感分析与高频词提取 (饼图与Excel) ---")
-    sentiments_overall_counts = {'positive': 0, 'neutral': 0, 'negative': 0}
+    pie_chart_futures = []
+    # 饼图的绘制与PNG编码写盘在后台线程中进行，退出 with 块时等待所有饼图保存完毕 (出错时也会关闭线程池)
+    with ThreadPoolExecutor(max_workers=2) as pie_chart_pool:
+        # 1. 总体情感分析 (饼图用) 和 总体情感高频词提取 (Excel用)
+        print("\n--- 开始总体评论情感分析与高频词提取 (饼图与Excel) ---")
+        # 每条评论只打分一次，得到的情感掩码同时用于总体统计和下面的分类别统计
+        valid_comments = [text for text in comment_texts if text and text.strip()]
+        sentiment_keys = ('positive', 'neutral', 'negative')
+        masks = sentiment_masks(score_texts(valid_comments))
+        categorized_all_comments = {key: list(compress(valid_comments, mask)) for key, mask in zip(sentiment_keys, masks)}
+        sentiments_overall_counts = {key: int(mask.sum()) for key, mask in zip(sentiment_keys, masks)}
     
-    categorized_all_comments = classify_texts_by_sentiment(comment_texts)
+        # print(f"总体评论情感分布: 正面={sentiments_overall_counts['positive']}, 中性={sentiments_overall_counts['neutral']}, 负面={sentiments_overall_counts['negative']}")
+        if sum(sentiments_overall_counts.values()) > 0:
+            pie_chart_futures.append(pie_chart_pool.submit(plot_pie_chart, dict(sentiments_overall_counts), "评论区总体情感分布", OVERALL_SENTIMENT_PIE_CHART_FILE))
+        # else:
+            # print("没有总体评论情感数据可供绘制饼图。")
 
-    for sentiment_key, texts in categorized_all_comments.items():
-        sentiments_overall_counts[sentiment_key] = len(texts)
-    
-    # print(f"总体评论情感分布: 正面={sentiments_overall_counts['positive']}, 中性={sentiments_overall_counts['neutral']}, 负面={sentiments_overall_counts['negative']}")
-    if sum(sentiments_overall_counts.values()) > 0:
-        plot_pie_chart(sentiments_overall_counts, "评论区总体情感分布", OVERALL_SENTIMENT_PIE_CHART_FILE)
-    # else:
-        # print("没有总体评论情感数据可供绘制饼图。")
+        # print("  正在为总体评论提取情感高频词 (Excel用)...")
+        for sentiment_key, texts_in_category in categorized_all_comments.items():
+            if texts_in_category:
+                top_words = get_top_n_words(texts_in_category, TOP_N_SENTIMENT_WORDS) # 使用配置的TOP_N
+                if top_words:
+                    # print(f"    总体评论 - {sentiment_label_chinese_map[sentiment_key]} ({len(texts_in_category)}条) 高频词 (Excel用):")
+                    for word, freq in top_words:
+                        # print(f"      {word}: {freq}") # 可选打印
+                        all_sentiment_word_data_for_excel.append(
+                            ('评论', '整体', sentiment_label_chinese_map[sentiment_key], word, freq))
+
+        # 2. 分类别情感分析 (仅饼图用, 不提取此类别的特定高频词到Excel，除非需求变更)
+        if sentiment_categories_keywords:
+            print("\n--- 开始分类别评论情感分析 (仅饼图) ---")
+            # 一遍扫描得到 评论×类别 的归属矩阵，再与总体分析得到的 评论×情感 掩码矩阵相乘，一次得到每个类别下各情感的条数
+            membership = keyword_category_membership([text.lower() for text in valid_comments], sentiment_categories_keywords)
+            sentiment_onehot = np.column_stack(masks).astype(np.int64) # 列: 积极, 中立, 消极
+            counts_by_category = membership.T.astype(np.int64) @ sentiment_onehot
+            for category_index, category_name in enumerate(sentiment_categories_keywords):
+                # print(f"\n  正在分析类别: {category_name}")
+                if membership[:, category_index].any():
+                    # print(f"    找到 {int(membership[:, category_index].sum())} 条与 '{category_name}' 相关的评论。")
+                    topic_sentiment_counts = dict(zip(sentiment_keys, counts_by_category[category_index].tolist()))
+
+                    # print(f"    '{category_name}' 相关评论情感: 正面={topic_sentiment_counts['positive']}, 中性={topic_sentiment_counts['neutral']}, 负面={topic_sentiment_counts['negative']}")
+                    safe_category_name = category_name.translate(_FILENAME_SAFE_TABLE) # 文件名安全
+                    category_pie_chart_filename = os.path.join(OUTPUT_DIR, f"comment_sentiment_pie_{safe_category_name}.png")
+                    pie_chart_futures.append(pie_chart_pool.submit(plot_pie_chart, topic_sentiment_counts, f"与'{category_name}'相关评论的情感分布", category_pie_chart_filename))
+                # else:
+                    # print(f"    未找到与 '{category_name}' 相关的评论，不生成饼图。")
+        # else:
+            # print("\n未提供分类别情感分析的关键词，跳过此部分。")
 
-    # print("  正在为总体评论提取情感高频词 (Excel用)...")
-    for sentiment_key, texts_in_category in categorized_all_comments.items():
-        if texts_in_category:
-            top_words = get_top_n_words(texts_in_category, TOP_N_SENTIMENT_WORDS) # 使用配置的TOP_N
-            if top_words:
-                # print(f"    总体评论 - {sentiment_label_chinese_map[sentiment_key]} ({len(texts_in_category)}条) 高频词 (Excel用):")
-                for word, freq in top_words:
-                    # print(f"      {word}: {freq}") # 可选打印
-                    all_sentiment_word_data_for_excel.append({
-                        'Type': '评论', 'Scope': '整体',
-                        'Sentiment': sentiment_label_chinese_map[sentiment_key],
-                        'Word': word, 'Frequency': freq
-                    })
-
-    # 2. 分类别情感分析 (仅饼图用, 不提取此类别的特定高频词到Excel，除非需求变更)
-    if sentiment_categories_keywords:
-        print("\n--- 开始分类别评论情感分析 (仅饼图) ---")
-        for category_name, keywords in sentiment_categories_keywords.items():
-            # print(f"\n  正在分析类别: {category_name}")
-            category_specific_texts = []
-            keywords_lower = [k.lower() for k in keywords] # 转换为小写以进行不区分大小写的匹配
-            
-            for text in comment_texts: 
-                if not text or not text.strip():
-                    continue
-                text_lower = text.lower()
-                if any(keyword in text_lower for keyword in keywords_lower): # 如果评论包含任一关键词
-                    category_specific_texts.append(text)
-            
-            if category_specific_texts:
-                # print(f"    找到 {len(category_specific_texts)} 条与 '{category_name}' 相关的评论。")
-                categorized_topic_comments = classify_texts_by_sentiment(category_specific_texts)
-                topic_sentiment_counts = {k: len(v) for k, v in categorized_topic_comments.items()}
-
-                # print(f"    '{category_name}' 相关评论情感: 正面={topic_sentiment_counts['positive']}, 中性={topic_sentiment_counts['neutral']}, 负面={topic_sentiment_counts['negative']}")
-                safe_category_name = re.sub(r'[\\/*?:"<>|]', "_", category_name) # 文件名安全
-                category_pie_chart_filename = os.path.join(OUTPUT_DIR, f"comment_sentiment_pie_{safe_category_name}.png")
-                plot_pie_chart(topic_sentiment_counts, f"与'{category_name}'相关评论的情感分布", category_pie_chart_filename)
-            # else:
-                # print(f"    未找到与 '{category_name}' 相关的评论，不生成饼图。")
-    # else:
-        # print("\n未提供分类别情感分析的关键词，跳过此部分。")
+    for future in pie_chart_futures:
+        if future.exception() is not None:
+            print(f"绘制饼图时出错: {future.exception()}")
 
 # --- 新增：传统文化节目弹幕专项分析函数 ---
 def get_danmaku_for_specific_programs(all_segmented_danmaku, program_identifiers, use_fuzzy=False, fuzzy_threshold=80):
@@ -936,39 +2038,53 @@ def get_danmaku_for_specific_programs(all_segmented_danmaku, program_identifiers
         return combined_danmaku
 
     print(f"\n--- 正在筛选传统文化节目的弹幕 ---")
-    if use_fuzzy and THEFUZZ_AVAILABLE:
+    if use_fuzzy and RAPIDFUZZ_AVAILABLE:
         print(f"筛选模式: 模糊匹配 (阈值: {fuzzy_threshold})")
     else:
-        if use_fuzzy and not THEFUZZ_AVAILABLE:
-            print("筛选模式: 精确子字符串匹配 (模糊匹配库 'thefuzz' 不可用)")
+        if use_fuzzy and not RAPIDFUZZ_AVAILABLE:
+            print("筛选模式: 精确子字符串匹配 (模糊匹配库 'rapidfuzz' 不可用)")
         else:
             print("筛选模式: 精确子字符串匹配")
     print(f"筛选依据 (节目名称或关键词): {program_identifiers}")
 
     found_programs_count = 0
     matched_segment_names = set()
-
+    identifier_pairs = [(identifier, identifier.lower()) for identifier in program_identifiers] # 关键词只需小写一次，所有片段共用
+
+    # 片段名称 -> 匹配到的关键词 (未匹配为 None)。先做廉价的子串匹配：包含关键词的片段名相似度必然为100，无需再算模糊匹配
+    matched_identifiers = {}
+    segment_names_lower = {name: name.lower() for name in all_segmented_danmaku} # 片段名只小写一次，子串匹配与模糊匹配共用
+    if AHOCORASICK_AVAILABLE:
+        # 全部关键词构建一个自动机，每个片段名只扫描一遍；命中多个关键词时取列表中最靠前的，与逐个判断的结果一致
+        automaton = ahocorasick.Automaton()
+        for identifier_index, (identifier, identifier_lower) in reversed(list(enumerate(identifier_pairs))):
+            automaton.add_word(identifier_lower, (identifier_index, identifier)) # 倒序添加，小写后重复的关键词保留最靠前的
+        automaton.make_automaton()
+        for segment_name_csv in all_segmented_danmaku:
+            hits = [hit for _, hit in automaton.iter(segment_names_lower[segment_name_csv])]
+            matched_identifiers[segment_name_csv] = min(hits)[1] if hits else None
+    else:
+        for segment_name_csv, segment_name_csv_lower in segment_names_lower.items():
+            matched_identifiers[segment_name_csv] = next(
+                (identifier for identifier, identifier_lower in identifier_pairs if identifier_lower in segment_name_csv_lower), None)
+
+    unmatched_names = [name for name, identifier in matched_identifiers.items() if identifier is None]
+    if use_fuzzy and RAPIDFUZZ_AVAILABLE and unmatched_names:
+        # 只对子串匹配不上的片段，一次调用算出 关键词×片段 的相似度矩阵 (C++多线程)，代替逐对调用 partial_ratio
+        scores = rapidfuzz_process.cdist([identifier_lower for _, identifier_lower in identifier_pairs],
+                                         [segment_names_lower[name] for name in unmatched_names],
+                                         scorer=fuzz.partial_ratio, score_cutoff=fuzzy_threshold, workers=-1) # 低于阈值的组合可提前结束计算 (记为0)
+        is_above_threshold = np.asarray(scores) >= fuzzy_threshold
+        first_matches = is_above_threshold.argmax(axis=0)
+        for name, first_match, has_match in zip(unmatched_names, first_matches.tolist(), is_above_threshold.any(axis=0).tolist()):
+            if has_match:
+                matched_identifiers[name] = identifier_pairs[first_match][0]
+                # print(f"  [模糊匹配成功] 片段: '{name}' (与关键词 '{identifier_pairs[first_match][0]}' 相似度达到阈值)")
+
+    matched_danmaku_lists = []
     for segment_name_csv, danmaku_texts in all_segmented_danmaku.items():
-        matched_by_identifier = None
-        is_match = False
-        segment_name_csv_lower = segment_name_csv.lower()
-
-        for identifier in program_identifiers:
-            identifier_lower = identifier.lower()
-            if use_fuzzy and THEFUZZ_AVAILABLE:
-                # Using partial_ratio which is good for finding if a shorter string (identifier) is part of a longer one (segment_name_csv)
-                similarity_score = fuzz.partial_ratio(identifier_lower, segment_name_csv_lower)
-                if similarity_score >= fuzzy_threshold:
-                    is_match = True
-                    matched_by_identifier = identifier
-                    # print(f"  [模糊匹配成功] 片段: '{segment_name_csv}' (与关键词 '{identifier}' 相似度: {similarity_score}%)")
-                    break 
-            else:
-                if identifier_lower in segment_name_csv_lower:
-                    is_match = True
-                    matched_by_identifier = identifier
-                    # print(f"  [精确匹配成功] 片段: '{segment_name_csv}' (包含关键词 '{identifier}')")
-                    break
+        matched_by_identifier = matched_identifiers[segment_name_csv]
+        is_match = matched_by_identifier is not None
         
         if is_match:
             if segment_name_csv not in matched_segment_names: # Count unique matched segments
@@ -977,10 +2093,12 @@ def get_danmaku_for_specific_programs(all_segmented_danmaku, program_identifiers
                 print(f"  匹配到节目片段: '{segment_name_csv}' (通过关键词: '{matched_by_identifier}'). 添加 {len(danmaku_texts)} 条弹幕。")
             else: # Already added danmaku from this segment if identifiers overlap for the same segment
                 print(f"  片段 '{segment_name_csv}' 已通过其他关键词匹配过，追加弹幕 (当前关键词: '{matched_by_identifier}')")
-            combined_danmaku.extend(danmaku_texts)
+            matched_danmaku_lists.append(danmaku_texts) # 只保存引用，最后一次性拼接
         # else:
             # print(f"  [未匹配] 片段: '{segment_name_csv}'")
 
+    # 按总长度一次分配并拷贝，代替逐个片段 extend 时列表的反复扩容
+    combined_danmaku = list(chain.from_iterable(matched_danmaku_lists))
 
     if found_programs_count == 0:
         print(f"警告: 未能从已加载的片段中匹配到任何指定的传统文化节目。")
@@ -1007,25 +2125,17 @@ def analyze_traditional_danmaku_word_frequency(danmaku_texts, top_n=10, exclude_
         exclude_set_lower = {ex_k.lower() for ex_k in exclude_exact_words}
         print(f"将从词频统计中排除以下精确匹配的词语 (不区分大小写): {exclude_exact_words}")
 
-    all_words_for_freq = []
-    for text in danmaku_texts:
-        # preprocess_text 进行分词、去停用词、去单字等
-        processed_tokens = preprocess_text(text) # custom_filter_words=None 默认不过滤特定模式
-        
-        # 进一步排除 EXCLUDE_WORDS_FROM_FREQUENCY_ANALYSIS 中指定的精确词汇
-        if exclude_set_lower:
-            tokens_after_specific_exclusion = [
-                token for token in processed_tokens if token.lower() not in exclude_set_lower
-            ]
-            all_words_for_freq.extend(tokens_after_specific_exclusion)
-        else:
-            all_words_for_freq.extend(processed_tokens)
-            
-    if not all_words_for_freq:
+    # preprocess_texts 进行分词、去停用词、去单字等 (custom_filter_words=None 默认不过滤特定模式)
+    # 词元直接流入 Counter 计数，不生成中间的全量词列表
+    word_counts = count_tokens(preprocess_texts(danmaku_texts))
+    # 进一步排除 EXCLUDE_WORDS_FROM_FREQUENCY_ANALYSIS 中指定的精确词汇 (计数后按不同词判断，每个词只 lower() 一次)
+    if exclude_set_lower:
+        word_counts = Counter({word: count for word, count in word_counts.items() if word.lower() not in exclude_set_lower})
+
+    if not word_counts:
         print("预处理和指定词排除后，没有剩余词语可供分析。")
         return []
 
-    word_counts = Counter(all_words_for_freq)
     total_valid_words = sum(word_counts.values())
     
     if total_valid_words == 0:
@@ -1037,7 +2147,7 @@ def analyze_traditional_danmaku_word_frequency(danmaku_texts, top_n=10, exclude_
     print("------------------------------------------------------")
     print(f"| {'排名':<4} | {'关键词':<25} | {'频次':<8} | {'占比 (%)':<10} |")
     print("------------------------------------------------------")
-    for i, (word, count) in enumerate(word_counts.most_common(top_n), 1):
+    for i, (word, count) in enumerate(top_n_from_counter(word_counts, top_n), 1):
         percentage = (count / total_valid_words) * 100 if total_valid_words > 0 else 0
         print(f"| {i:<4} | {word:<25} | {count:<8} | {percentage:>9.2f}% |") # 调整关键词宽度
         top_words_data.append({"rank": i, "word": word, "count": count, "percentage": percentage})
@@ -1045,9 +2155,10 @@ def analyze_traditional_danmaku_word_frequency(danmaku_texts, top_n=10, exclude_
     
     return top_words_data
 
-def analyze_traditional_danmaku_sentiment_distribution(danmaku_texts):
+def analyze_traditional_danmaku_sentiment_distribution(danmaku_texts, categorized_texts=None):
     """
     2. 对传统文化节目的所有弹幕进行情感分析，结果为积极，消极，中立三个种类，并给出三个种类分别占比。
+    categorized_texts: 已有的 classify_texts_by_sentiment(danmaku_texts) 结果，提供时不再重新分类。
     """
     if not danmaku_texts:
         print("没有传统文化节目弹幕文本可供情感分布分析。")
@@ -1056,7 +2167,8 @@ def analyze_traditional_danmaku_sentiment_distribution(danmaku_texts):
     print("\n--- 传统文化节目弹幕 情感分布分析 ---")
     
     # 使用已有的 classify_texts_by_sentiment 函数
-    categorized_texts = classify_texts_by_sentiment(danmaku_texts) 
+    if categorized_texts is None:
+        categorized_texts = classify_texts_by_sentiment(danmaku_texts)
 
     positive_count = len(categorized_texts['positive'])
     negative_count = len(categorized_texts['negative'])
@@ -1090,9 +2202,10 @@ def analyze_traditional_danmaku_sentiment_distribution(danmaku_texts):
         'total': total_analyzed
     }
 
-def extract_traditional_danmaku_typical_sentiment_words(danmaku_texts, top_n_per_sentiment=10):
+def extract_traditional_danmaku_typical_sentiment_words(danmaku_texts, top_n_per_sentiment=10, categorized_texts=None):
     """
     3. 根据第二条分析的结果，将提取出的词整理，给出三类情感典型词清单（三种感情分开给）。
+    categorized_texts: 第二条分析所用的情感分类结果，提供时直接复用。
     """
     if not danmaku_texts:
         print("没有传统文化节目弹幕文本可供提取典型情感词。")
@@ -1101,7 +2214,8 @@ def extract_traditional_danmaku_typical_sentiment_words(danmaku_texts, top_n_per
     print(f"\n--- 传统文化节目弹幕 典型情感词提取 (每类 Top {top_n_per_sentiment}) ---")
 
     # 复用情感分类结果，或重新分类
-    categorized_texts = classify_texts_by_sentiment(danmaku_texts)
+    if categorized_texts is None:
+        categorized_texts = classify_texts_by_sentiment(danmaku_texts)
 
     typical_words_output = {'positive': [], 'negative': [], 'neutral': []}
 
@@ -1128,6 +2242,128 @@ def extract_traditional_danmaku_typical_sentiment_words(danmaku_texts, top_n_per
 
 
 # --- 主执行逻辑 ---
+async def fetch_video_data(video_input, video_segments_to_analyze):
+    """
+    登录并获取视频的分段弹幕与评论 (只负责网络获取，不做分析)。
+    返回 {'title', 'aid', 'bvid', 'segmented_danmaku', 'comment_texts', 'failed_segments', 'comments_complete'}；
+    comment_texts 为 None 表示未能获取评论，failed_segments 为未能获取弹幕的片段名列表。
+    登录或视频信息获取失败时返回 None。
+    """
+    print("\n--- 开始获取B站登录凭证 ---")
+    credential = get_bilibili_credential()
+
+    if not credential:
+        print("未能获取B站登录凭证。脚本无法继续执行需要登录的操作。")
+        return None
+    print("成功获取或加载B站登录凭证。")
+
+    video = None 
+    try:
+        if video_input.upper().startswith("BV") : 
+            video = Video(bvid=video_input, credential=credential)
+        elif video_input.isdigit(): 
+            video = Video(aid=int(video_input), credential=credential)
+        else:
+            print(f"错误: 无法从 '{video_input}' 中识别视频ID。请输入有效的BV号或AID。")
+            return None
+    except Exception as e:
+        print(f"初始化Video对象时出错: {e}")
+        return None
+
+    print(f"正在处理视频: {video_input}")
+    try:
+        video_info_data = await cached_api_call(("video_info", video.get_bvid()), lambda: video.get_info(), "获取视频信息")
+        if not video_info_data or not video_info_data.get('title'):
+            print(f"错误: 无法获取视频 '{video_input}' 的有效信息 (标题/数据缺失)。请检查ID和网络连接。")
+            return None
+        print(f"已成功获取视频信息: {video_info_data.get('title', 'N/A')}")
+
+        retrieved_aid = video_info_data.get('aid')
+        if retrieved_aid:
+            video.aid = retrieved_aid # 确保video对象有aid属性，用于评论获取
+            # print(f"视频 AID 已成功设置为: {video.aid}")
+        elif not (hasattr(video, 'aid') and video.aid): # 如果get_info没返回aid且对象本身也没有
+            print(f"错误: 从视频信息中未能获取有效的 AID。视频数据详情: {video_info_data}")
+            return None # 评论获取将失败
+    except AttributeError as e_attr: # 例如 video 对象没有 get_info
+        print(f"错误: 处理视频信息时发生属性错误。错误详情: {e_attr}")
+        return None
+    except Exception as e: 
+        print(f"错误: 获取或处理视频 '{video_input}' 的信息时发生错误。请检查ID和网络连接。错误详情: {e}")
+        return None
+
+    # 弹幕与评论的请求互不依赖，同时进行，总耗时取两者中较长的一方而非两者之和
+    async def fetch_danmaku_part():
+        if not video_segments_to_analyze:
+            return {}
+        print("\n--- 开始获取弹幕 ---")
+        return await fetch_and_save_danmaku(video, video_segments_to_analyze, credential)
+
+    async def fetch_comments_part():
+        if not (hasattr(video, 'aid') and video.aid):
+            return None, False
+        print("\n--- 开始获取评论 ---")
+        return await fetch_comments(video, credential)
+
+    segmented_danmaku_result, (comment_texts, comments_complete) = await asyncio.gather(fetch_danmaku_part(), fetch_comments_part())
+
+    return {
+        'title': video_info_data.get('title'), 'aid': video.aid, 'bvid': video.get_bvid(),
+        'segmented_danmaku': segmented_danmaku_result, 'comment_texts': comment_texts,
+        # 获取失败的片段不会出现在 segmented_danmaku 中
+        'failed_segments': [name for name in (video_segments_to_analyze or {}) if name not in segmented_danmaku_result],
+        'comments_complete': comments_complete,
+    }
+
+def fetched_snapshot_path(bvid):
+    """按BV号定位弹幕/评论快照文件，同一视频以BV号或AID输入时共用一个快照。"""
+    return os.path.join(CACHE_DIR, f"fetched_{bvid}.pkl")
+
+def resolve_bvid(video_input):
+    """将输入的BV号 (前缀不区分大小写) 或 AID 统一转换为BV号 (本地换算，无需请求)。"""
+    if video_input.isdigit():
+        return aid2bvid(int(video_input))
+    return "BV" + video_input[2:]
+
+def is_fetched_data_complete(fetched_data):
+    """所有片段的弹幕都已获取 (没有失败的片段)，且评论完整获取时，才可以保存或复用为快照。"""
+    return (not fetched_data.get('failed_segments') and fetched_data.get('comment_texts') is not None
+            and fetched_data.get('comments_complete', False))
+
+def load_fetched_snapshot(snapshot_file, video_segments_to_analyze):
+    """读取上次运行保存的弹幕/评论快照；快照不存在、损坏、不完整、已过期或CSV片段定义已变化时返回 None。"""
+    if not os.path.exists(snapshot_file):
+        return None
+    try:
+        with open(snapshot_file, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        print(f"读取数据快照 {snapshot_file} 失败: {e}。将重新获取。")
+        return None
+    if not is_fetched_data_complete(snapshot):
+        print("快照中的弹幕/评论不完整，将重新获取。")
+        return None
+    if time.time() - snapshot.get('fetched_at', 0) > FETCHED_SNAPSHOT_TTL:
+        print("数据快照已过期，将重新获取。")
+        return None
+    if snapshot.get('segments_config') != video_segments_to_analyze:
+        print("CSV中的片段定义已变化，快照中的分段弹幕不再适用，将重新获取。")
+        return None
+    return snapshot
+
+def save_fetched_snapshot(snapshot_file, fetched_data, video_segments_to_analyze):
+    """将获取到的弹幕/评论保存为快照，之后的运行可跳过网络获取 (使用 --refresh 强制重新获取)。"""
+    try:
+        ensure_dir(CACHE_DIR)
+        with open(snapshot_file, "wb") as f:
+            pickle.dump(dict(fetched_data, segments_config=video_segments_to_analyze, fetched_at=time.time()),
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        print(f"已将获取的数据保存为快照: {snapshot_file}")
+    except Exception as e:
+        print(f"保存数据快照 {snapshot_file} 时出错: {e}")
+
+_VIDEO_ID_RE = re.compile(r"[Bb][Vv][0-9A-Za-z]{10}|[0-9]+") # BV号 ('BV' 开头加10位字母数字, 前缀不区分大小写) 或 AID (纯数字)
+
 async def main():
     global FONT_PATH 
     # 确保全局配置可访问，或者通过参数传递给需要它们的函数
@@ -1145,7 +2381,7 @@ async def main():
         # else: FONT_PATH remains as is, subsequent checks will handle it
 
     # 用于存储所有情感高频词数据以便最后写入Excel (此列表用于原有的Excel输出逻辑)
-    all_sentiment_word_data_for_excel = []
+    all_sentiment_word_data_for_excel = [] # 每行为 SENTIMENT_WORDS_EXCEL_COLUMNS 顺序的元组，最后一次性构造 DataFrame
 
     video_segments_to_analyze = load_segments_from_csv(CSV_FILE_PATH)
     if video_segments_to_analyze is None:
@@ -1157,8 +2393,7 @@ async def main():
     while True:
         video_input_raw = input("请输入目标视频的BV号 (例如 BV1aBfZYuEe7) 或 AID (纯数字): ").strip() 
         if video_input_raw:
-            if (video_input_raw.upper().startswith("BV") and len(video_input_raw) == 12 and video_input_raw[2:].isalnum()) or \
-               (video_input_raw.isdigit()):
+            if _VIDEO_ID_RE.fullmatch(video_input_raw):
                 break
             else:
                 print("输入格式不正确。BV号应为 'BV' 开头加10位字母数字，AID应为纯数字。请重新输入。")
@@ -1172,107 +2407,86 @@ async def main():
     if not (FONT_PATH and os.path.exists(FONT_PATH)):
         print(f"最终警告: 未能确定有效的中文字体路径 (当前 FONT_PATH: '{FONT_PATH}')。图表和词云图中文显示可能不正确。")
 
-    print("\n--- 开始获取B站登录凭证 ---")
-    credential = get_bilibili_credential_via_selenium()
-
-    if not credential:
-        print("未能获取B站登录凭证。脚本无法继续执行需要登录的操作。")
-        return
-    print("成功获取或加载B站登录凭证。")
-
-    video = None 
-    try:
-        if video_input.upper().startswith("BV") : 
-            video = Video(bvid=video_input, credential=credential)
-        elif video_input.isdigit(): 
-            video = Video(aid=int(video_input), credential=credential)
-        else:
-            print(f"错误: 无法从 '{video_input}' 中识别视频ID。请输入有效的BV号或AID。")
-            return
-    except Exception as e:
-        print(f"初始化Video对象时出错: {e}")
-        return
+    snapshot_file = fetched_snapshot_path(resolve_bvid(video_input))
+    fetched_data = None
+    if REFRESH_FETCHED_DATA:
+        print("已指定 --refresh，将重新获取弹幕与评论。")
+    else:
+        fetched_data = load_fetched_snapshot(snapshot_file, video_segments_to_analyze)
 
-    print(f"正在处理视频: {video_input}")
-    try:
-        video_info_data = await video.get_info() 
-        if not video_info_data or not video_info_data.get('title'):
-            print(f"错误: 无法获取视频 '{video_input}' 的有效信息 (标题/数据缺失)。请检查ID和网络连接。")
+    if fetched_data is not None:
+        print(f"已从快照 {snapshot_file} 加载视频 '{fetched_data.get('title', 'N/A')}' 的弹幕与评论，跳过网络获取。")
+        # 后续的总弹幕分析读取合并TXT，按快照内容重新写出
+        save_combined_danmaku_txt(fetched_data['segmented_danmaku'].values())
+    else:
+        fetched_data = await fetch_video_data(video_input, video_segments_to_analyze)
+        if fetched_data is None:
             return
-        print(f"已成功获取视频信息: {video_info_data.get('title', 'N/A')}")
+        if is_fetched_data_complete(fetched_data):
+            save_fetched_snapshot(fetched_snapshot_path(fetched_data['bvid']), fetched_data, video_segments_to_analyze)
+        else:
+            print("部分弹幕片段或评论未能获取，本次数据不保存为快照。")
 
-        retrieved_aid = video_info_data.get('aid')
-        if retrieved_aid:
-            video.aid = retrieved_aid # 确保video对象有aid属性，用于评论获取
-            # print(f"视频 AID 已成功设置为: {video.aid}")
-        elif not (hasattr(video, 'aid') and video.aid): # 如果get_info没返回aid且对象本身也没有
-            print(f"错误: 从视频信息中未能获取有效的 AID。视频数据详情: {video_info_data}")
-            return # 评论获取将失败
-    except AttributeError as e_attr: # 例如 video 对象没有 get_info
-        print(f"错误: 处理视频信息时发生属性错误。错误详情: {e_attr}")
-        return 
-    except Exception as e: 
-        print(f"错误: 获取或处理视频 '{video_input}' 的信息时发生错误。请检查ID和网络连接。错误详情: {e}")
-        return 
+    load_sentiment_score_cache()
 
     print("\n--- 开始处理弹幕 (常规流程) ---")
-    segmented_danmaku_result = {} # 初始化
-    if video and video_segments_to_analyze: 
-        segmented_danmaku_result = await fetch_and_save_danmaku(video, video_segments_to_analyze, credential)
+    segmented_danmaku_result = fetched_data['segmented_danmaku']
+    if segmented_danmaku_result: 
+        # 常规分析：每个片段的词云图，总弹幕TXT的词云图，以及这些的情感词提取到Excel
+        overall_word_counts, overall_sentiment_word_counts = analyze_danmaku_and_generate_wordclouds(segmented_danmaku_result, all_sentiment_word_data_for_excel)
+        # 合并TXT仍照常写出供查看，但总弹幕分析直接使用片段阶段累加的词频，不再读回TXT
+        analyze_overall_danmaku_from_txt(DANMAKU_TXT_FILE, OVERALL_WORDCLOUD_IMAGE_FILE, all_sentiment_word_data_for_excel,
+                                         precomputed_word_counts=overall_word_counts,
+                                         precomputed_sentiment_word_counts=overall_sentiment_word_counts)
         
-        if segmented_danmaku_result: 
-            # 常规分析：每个片段的词云图，总弹幕TXT的词云图，以及这些的情感词提取到Excel
-            analyze_danmaku_and_generate_wordclouds(segmented_danmaku_result, all_sentiment_word_data_for_excel)
-            if os.path.exists(DANMAKU_TXT_FILE):
-                 analyze_overall_danmaku_from_txt(DANMAKU_TXT_FILE, OVERALL_WORDCLOUD_IMAGE_FILE, all_sentiment_word_data_for_excel)
-            # else:
-                # print(f"提示: 合并弹幕文件 {DANMAKU_TXT_FILE} 未生成，无法进行基于TXT的总弹幕情感词分析。")
-            
-            # --- 新增：针对传统文化节目的弹幕专项分析 ---
-            if TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS:
-                # 1. 筛选出传统文化节目的弹幕
-                traditional_danmaku_texts = get_danmaku_for_specific_programs(
-                    segmented_danmaku_result, 
-                    TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS,
-                    use_fuzzy=USE_FUZZY_MATCHING_FOR_PROGRAM_FILTER, # Pass fuzzy config
-                    fuzzy_threshold=FUZZY_MATCH_THRESHOLD
+        # --- 新增：针对传统文化节目的弹幕专项分析 ---
+        if TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS:
+            # 1. 筛选出传统文化节目的弹幕
+            traditional_danmaku_texts = get_danmaku_for_specific_programs(
+                segmented_danmaku_result, 
+                TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS,
+                use_fuzzy=USE_FUZZY_MATCHING_FOR_PROGRAM_FILTER, # Pass fuzzy config
+                fuzzy_threshold=FUZZY_MATCH_THRESHOLD
+            )
+
+            if traditional_danmaku_texts:
+                # 1a. 词频分析 (Top N, 排除指定词)
+                analyze_traditional_danmaku_word_frequency(
+                    traditional_danmaku_texts, 
+                    top_n=TOP_N_TRADITIONAL_FREQ_WORDS, 
+                    exclude_exact_words=EXCLUDE_WORDS_FROM_FREQUENCY_ANALYSIS
                 )
 
-                if traditional_danmaku_texts:
-                    # 1a. 词频分析 (Top N, 排除指定词)
-                    analyze_traditional_danmaku_word_frequency(
-                        traditional_danmaku_texts, 
-                        top_n=TOP_N_TRADITIONAL_FREQ_WORDS, 
-                        exclude_exact_words=EXCLUDE_WORDS_FROM_FREQUENCY_ANALYSIS
-                    )
-
-                    # 1b. 情感分布分析
-                    analyze_traditional_danmaku_sentiment_distribution(
-                        traditional_danmaku_texts
-                    )
-                    
-                    # 1c. 典型情感词提取
-                    extract_traditional_danmaku_typical_sentiment_words(
-                        traditional_danmaku_texts, 
-                        top_n_per_sentiment=TOP_N_TRADITIONAL_SENTIMENT_WORDS
-                    )
-                else:
-                    print("\n未能收集到传统文化节目的弹幕，跳过其特定分析。")
-            else:
-                print("\n未配置传统文化节目关键词 (TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS)，跳过其特定分析。")
-            # --- 传统文化节目专项分析结束 ---
+                # 情感分类只做一次，情感分布与典型情感词两项分析共用
+                traditional_categorized_texts = classify_texts_by_sentiment(traditional_danmaku_texts)
 
+                # 1b. 情感分布分析
+                analyze_traditional_danmaku_sentiment_distribution(
+                    traditional_danmaku_texts,
+                    categorized_texts=traditional_categorized_texts
+                )
+                
+                # 1c. 典型情感词提取
+                extract_traditional_danmaku_typical_sentiment_words(
+                    traditional_danmaku_texts, 
+                    top_n_per_sentiment=TOP_N_TRADITIONAL_SENTIMENT_WORDS,
+                    categorized_texts=traditional_categorized_texts
+                )
+            else:
+                print("\n未能收集到传统文化节目的弹幕，跳过其特定分析。")
         else:
-            print("由于未获取到弹幕，跳过所有弹幕分析。")
-    elif not video_segments_to_analyze:
+            print("\n未配置传统文化节目关键词 (TRADITIONAL_CULTURE_PROGRAM_NAMES_OR_KEYWORDS)，跳过其特定分析。")
+        # --- 传统文化节目专项分析结束 ---
+
+    elif video_segments_to_analyze:
+        print("由于未获取到弹幕，跳过所有弹幕分析。")
+    else:
         print("错误：视频片段定义为空，跳过弹幕处理。")
-    # else: (video object not initialized, already handled)
-    #     print("错误：Video对象未成功初始化，跳过弹幕处理。")
 
 
-    if hasattr(video, 'aid') and video.aid:
+    comment_texts = fetched_data['comment_texts']
+    if comment_texts is not None:
         print("\n--- 开始处理评论 (常规流程) ---")
-        comment_texts = await fetch_comments(video, credential)
         if comment_texts:
             # 定义评论区情感分析的分类关键词 (仅用于生成分类饼图，不影响Excel输出)
             comment_sentiment_categories_for_pie = { 
@@ -1289,21 +2503,35 @@ async def main():
     if all_sentiment_word_data_for_excel:
         print(f"\n--- 正在保存常规分析提取的情感高频词到Excel文件: {SENTIMENT_WORDS_EXCEL_FILE} ---")
         try:
-            df_sentiment_words = pd.DataFrame(all_sentiment_word_data_for_excel)
-            df_sentiment_words.to_excel(SENTIMENT_WORDS_EXCEL_FILE, index=False, engine='openpyxl')
+            if XLSXWRITER_AVAILABLE:
+                # 直接逐行写出各行元组，不构造 DataFrame；constant_memory 模式写完一行即落盘，内存占用不随行数增长
+                workbook = xlsxwriter.Workbook(SENTIMENT_WORDS_EXCEL_FILE, {'constant_memory': True})
+                try:
+                    worksheet = workbook.add_worksheet('Sheet1')
+                    worksheet.write_row(0, 0, SENTIMENT_WORDS_EXCEL_COLUMNS)
+                    for row_index, row in enumerate(all_sentiment_word_data_for_excel, 1):
+                        worksheet.write_row(row_index, 0, row)
+                finally:
+                    workbook.close()
+            else:
+                df_sentiment_words = pd.DataFrame.from_records(all_sentiment_word_data_for_excel, columns=SENTIMENT_WORDS_EXCEL_COLUMNS)
+                df_sentiment_words.to_excel(SENTIMENT_WORDS_EXCEL_FILE, index=False, engine='openpyxl')
             print(f"情感高频词数据已成功保存至: {SENTIMENT_WORDS_EXCEL_FILE}")
         except Exception as e:
             print(f"保存情感高频词Excel文件时出错: {e}")
-            print("请确保已安装 'openpyxl' 库: pip install openpyxl")
+            print("请确保已安装 'xlsxwriter' 或 'openpyxl' 库: pip install xlsxwriter")
     # else:
         # print("\n未能提取任何用于Excel的情感高频词数据，不生成Excel文件。")
 
+    save_sentiment_score_cache()
+
     print("\n处理完成。分析结果（如果生成）位于 'analysis_results' 目录中。")
 
 if __name__ == "__main__":
     print("重要提示：开始运行脚本前，请确保已安装所需库：")
-    print("  pip install bilibili-api-python selenium jieba snownlp matplotlib wordcloud pandas openpyxl httpx thefuzz python-Levenshtein") 
-    print("并且已正确配置 msedgedriver (Edge WebDriver)。脚本会尝试自动检测中文字体。\n")
+    print("  pip install bilibili-api-python jieba snownlp matplotlib wordcloud pandas openpyxl httpx qrcode rapidfuzz") 
+    print("默认通过扫码登录；若使用 Selenium 登录 (LOGIN_METHOD = \"selenium\")，还需安装 selenium 并配置 msedgedriver (Edge WebDriver)。")
+    print("脚本会尝试自动检测中文字体。\n")
 
     if os.name == 'nt' and sys.version_info >= (3,8):
         # For Windows asyncio policy if needed (usually not required for this script type)